@@ -1,8 +1,19 @@
 import os
 import secrets
-from typing import List
+from typing import Dict, List
 
-from pydantic import AnyHttpUrl, BaseSettings
+from pydantic import AnyHttpUrl, BaseModel, BaseSettings, root_validator
+
+
+class DiscordAccount(BaseModel):
+    """A discord user account driving midjourney in its own channel"""
+
+    name: str
+    user_token: str
+    guild_id: str
+    channel_id: str
+    session_id: str
+    concurrency_size: int = 3
 
 
 class Settings(BaseSettings):
@@ -26,6 +37,9 @@ class Settings(BaseSettings):
     REDIS_URL: str
     REDIS_HOST: str
     REDIS_PORT: str
+    REDIS_POOL_SIZE: int = 50
+    # how long a caller waits for a connection once the pool is used up
+    REDIS_POOL_TIMEOUT_SECONDS: int = 20
     APP_CACHE_EXPIRE_IN_SECONDS: int = 3600
 
     # CORS
@@ -47,16 +61,89 @@ class Settings(BaseSettings):
     DISCORD_CHANNEL_ID: str
     DISCORD_APPLICATION_ID: str
     DISCORD_SESSION_ID: str
+    DISCORD_HTTP_POOL_SIZE: int = 100
+    DISCORD_HTTP_POOL_SIZE_PER_HOST: int = 30
+    DISCORD_HTTP_KEEPALIVE_SECONDS: int = 60
+    DISCORD_HTTP_DNS_CACHE_SECONDS: int = 300
+    DISCORD_HTTP_TIMEOUT_SECONDS: int = 30
+    # discord cdn links expire after 24 hours
+    DISCORD_ATTACHMENT_CACHE_SECONDS: int = 60 * 60 * 20
+    DISCORD_ATTACHMENT_CACHE_SIZE: int = 1024
+    # json list of accounts, defaults to the single DISCORD_* account
+    DISCORD_ACCOUNTS: List[DiscordAccount] = []
+    # an account whose trigger failed is skipped for a while
+    DISCORD_ACCOUNT_COOLDOWN_SECONDS: int = 60
 
     NOTIFY_HOOK: AnyHttpUrl
+    NOTIFY_TIMEOUT_SECONDS: int = 10
+    NOTIFY_HOST_CONCURRENCY: int = 5
+    NOTIFY_POLL_SECONDS: int = 1
+    NOTIFY_OUTBOX_CONCURRENCY: int = 100
+    NOTIFY_OUTBOX_LEASE_SECONDS: int = 60
+    NOTIFY_MAX_ATTEMPTS: int = 8
+    NOTIFY_RETRY_BASE_SECONDS: int = 5
+    NOTIFY_RETRY_MAX_SECONDS: int = 60 * 10
+    # progress states of a task are sent at most once per interval
+    NOTIFY_PROGRESS_INTERVAL_SECONDS: int = 2
+    NOTIFY_MAILBOX_EXPIRE_SECONDS: int = 60 * 60 * 24
+
+    # midjourney
+    BANNED_WORDS_RELOAD_SECONDS: int = 10
 
     # baidu-translate
     BAIDU_APPID: str
     BAIDU_APPKEY: str
+    TRANSLATE_CACHE_EXPIRE_SECONDS: int = 60 * 60 * 24 * 7
+    TRANSLATE_CACHE_SIZE: int = 4096
+    TRANSLATE_HTTP_POOL_SIZE: int = 10
+    # concurrent prompts are sent to baidu together
+    TRANSLATE_BATCH_WINDOW_MS: int = 10
+    TRANSLATE_BATCH_SIZE: int = 20
+    TRANSLATE_BATCH_MAX_CHARS: int = 1500
 
     # task queue
     TASK_QUEUE_CONCURRENCY_SIZE: int = 3
     TASK_QUEUE_WAIT_SIZE: int = 10
+    TASK_QUEUE_POLL_SECONDS: int = 5
+    BLOB_STORE_EXPIRE_SECONDS: int = 60 * 60
+    UPLOAD_MAX_SIZE: int = 25 * 1024 * 1024
+    UPLOAD_CHUNK_SIZE: int = 64 * 1024
+    TASK_REAPER_INTERVAL_SECONDS: int = 10
+    # the bot resyncs its local copy of the running task ids
+    TASK_RUNNING_RESYNC_SECONDS: int = 30
+    # a running task fails once its action timeout expires
+    TASK_TIMEOUT_SECONDS: int = 60 * 10
+    TASK_ACTION_TIMEOUT_SECONDS: Dict[str, int] = {
+        "imagine": 60 * 10,
+        "variation": 60 * 10,
+        "reset": 60 * 10,
+        "blend": 60 * 10,
+        "upscale": 60 * 5,
+        "describe": 60 * 2,
+    }
+    # bot-side status transitions are written to redis in batches
+    TASK_STATUS_BATCH_WINDOW_MS: int = 20
+    TASK_STATUS_BATCH_SIZE: int = 100
+    # task events streamed to sse / websocket subscribers
+    TASK_EVENT_QUEUE_SIZE: int = 16
+    TASK_EVENT_HEARTBEAT_SECONDS: int = 15
+    TASK_BATCH_MAX_SIZE: int = 500
+    TASK_LIST_MAX_PAGE_SIZE: int = 100
+
+    @root_validator(skip_on_failure=True)
+    def default_discord_accounts(cls, values: Dict) -> Dict:
+        if not values["DISCORD_ACCOUNTS"]:
+            values["DISCORD_ACCOUNTS"] = [
+                DiscordAccount(
+                    name="default",
+                    user_token=values["DISCORD_USER_TOKEN"],
+                    guild_id=values["DISCORD_GUILD_ID"],
+                    channel_id=values["DISCORD_CHANNEL_ID"],
+                    session_id=values["DISCORD_SESSION_ID"],
+                    concurrency_size=values["TASK_QUEUE_CONCURRENCY_SIZE"],
+                )
+            ]
+        return values
 
 
 settings = Settings(_env_file=".env")  # type: ignore
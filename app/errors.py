@@ -8,19 +8,22 @@ class UserBizError(IntEnum):
 class TriggerBizError(IntEnum):
     NOT_SUPPORT_FILE_TYPE = 21001
     TASK_NOT_FOUNT = 21002
+    FILE_TOO_LARGE = 21003
 
 
 class DiscordBizError(IntEnum):
     UPLOAD_ATTACHMENT_ERR = 31001
     BANNED_WORDS = 31002
+    ATTACHMENT_EXPIRED = 31003
 
 
 class TranslateBizError(IntEnum):
     TRANSLATE_INVALID = 41001
+    TRANSLATE_FAIL = 41002
 
 
 class TaskQueueBizError(IntEnum):
-    QUEUE_FILL = 51001
+    QUEUE_FULL = 51001
     SUBMIT_TASK_ERR = 51002
 
 
@@ -5,9 +5,15 @@ from starlette.staticfiles import StaticFiles
 
 from app.api import v1
 from app.config import settings
+from app.trigger.services.discord import discord_pool
+from app.trigger.services.event import task_event_service
+from app.trigger.services.notify import notify_service
+from app.trigger.services.queue import task_queue_service
+from app.trigger.services.translate import translate_service
 from app.utils.db import setup_db
 from app.utils.exception_handler import setup_exception_handler
 from app.utils.logger import setup_logger
+from app.utils.redis import async_redis_client
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -46,14 +52,23 @@ setup_db(
 
 @app.on_event("startup")
 async def startup() -> None:
+    await discord_pool.setup()
     if settings.REDIS_TESTING:
         return
+    await task_queue_service.start()
+    await notify_service.start()
+    await task_event_service.start()
 
 
 @app.on_event("shutdown")
 async def shutdown() -> None:
-    if settings.REDIS_TESTING:
-        return
+    await task_event_service.close()
+    await notify_service.close()
+    if not settings.REDIS_TESTING:
+        await task_queue_service.stop()
+        await async_redis_client.close(close_connection_pool=True)
+    await discord_pool.close()
+    await translate_service.close()
 
 
 def run_app():
@@ -0,0 +1,31 @@
+from fastapi import APIRouter
+
+from app.trigger.schemas.notify import ReplayRequest, ReplayResponse
+from app.trigger.services.notify import notify_service
+from app.utils.json import json_response
+from app.utils.response import Response
+
+router = APIRouter(
+    prefix="/notify",
+    tags=["notify"],
+)
+
+
+@router.get(
+    "/dead",
+    response_model=Response,
+    summary="Query dead letter notifications",
+)
+async def dead_letters():
+    data = await notify_service.dead_letters()
+    return json_response(data=data)
+
+
+@router.post(
+    "/replay",
+    response_model=Response[ReplayResponse],
+    summary="Replay dead letter notifications",
+)
+async def replay(request: ReplayRequest):
+    replayed = await notify_service.replay(request.ids)
+    return json_response(data=ReplayResponse(replayed=replayed))
@@ -1,9 +1,19 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 
-from app.trigger.schemas.task import Task
+from app.trigger.schemas.task import (
+    Task,
+    TaskBatchRequest,
+    TaskBatchResponse,
+    TaskQuery,
+)
+from app.trigger.services.event import task_event_service
+from app.trigger.services.queue import task_queue_service
 from app.trigger.services.task import task_service
+from app.trigger.services.translate import translate_service
 from app.utils.json import json_response
-from app.utils.response import Response
+from app.utils.rerequest import PaginationRequest
+from app.utils.response import PaginationResponse, Response
 
 router = APIRouter(
     prefix="/task",
@@ -11,11 +21,96 @@ router = APIRouter(
 )
 
 
+# registered before /{task_id}, which would match "list" too
+@router.get(
+    "/list",
+    response_model=Response[PaginationResponse[Task]],
+    summary="Query tasks by status, action, notify hook or submit time",
+)
+async def task_list(
+    query: TaskQuery = Depends(),
+    page: PaginationRequest = Depends(),
+):
+    data = await task_service.find_all(query, page)
+    return json_response(data=data)
+
+
 @router.get(
     "/{task_id}",
     response_model=Response[Task],
     summary="Query task details",
 )
 async def details(task_id: str):
-    data = task_service.details(task_id)
+    data = await task_service.details(task_id)
+    return json_response(data=data)
+
+
+@router.post(
+    "/batch",
+    response_model=Response[TaskBatchResponse],
+    summary="Query many task details",
+)
+async def batch_details(request: TaskBatchRequest):
+    data = await task_service.batch_details(request.ids)
+    return json_response(data=data)
+
+
+@router.get(
+    "/queue/metrics",
+    response_model=Response,
+    summary="Query task queue metrics",
+)
+async def queue_metrics():
+    data = await task_queue_service.metrics()
     return json_response(data=data)
+
+
+@router.get(
+    "/translate/metrics",
+    response_model=Response,
+    summary="Query prompt translation cache metrics",
+)
+async def translate_metrics():
+    data = translate_service.metrics()
+    return json_response(data=data)
+
+
+async def sse_events(task_id: str):
+    async for task in task_event_service.watch(task_id):
+        if task is None:
+            yield ": ping\n\n"
+        else:
+            yield f"event: task\ndata: {task.json()}\n\n"
+
+
+@router.get(
+    "/{task_id}/events",
+    summary="Stream task changes as server-sent events",
+)
+async def events(task_id: str):
+    # raise task not found before the stream starts
+    await task_service.details(task_id)
+    return StreamingResponse(
+        sse_events(task_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.websocket("/{task_id}/ws")
+async def ws_events(websocket: WebSocket, task_id: str):
+    await websocket.accept()
+    found = False
+    try:
+        async for task in task_event_service.watch(task_id):
+            found = True
+            if task is None:
+                await websocket.send_json({"event": "ping"})
+            else:
+                await websocket.send_text(
+                    f'{{"event": "task", "data": {task.json()}}}'
+                )
+    except WebSocketDisconnect:
+        return
+    # 4404 tells the client the task does not exist
+    await websocket.close(code=1000 if found else 4404)
@@ -1,5 +1,6 @@
 from fastapi import APIRouter, UploadFile
 
+from app.config import settings
 from app.errors import TriggerBizError
 from app.trigger.schemas.trigger import (
     BlendRequest,
@@ -31,12 +32,14 @@ async def upload(file: UploadFile):
         raise APPException(TriggerBizError.NOT_SUPPORT_FILE_TYPE)
 
     file_size = file.size
+    if file_size and file_size > settings.UPLOAD_MAX_SIZE:
+        raise APPException(TriggerBizError.FILE_TOO_LARGE)
     file_type = file.content_type.split("/")[-1]
-    image_bytes = await file.read()
+    # streamed to discord from the spooled file, never read whole
     data = await trigger_service.upload(
         file_size,
         file_type,
-        image_bytes,
+        file,
     )
     return json_response(data=data)
 
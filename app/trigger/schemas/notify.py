@@ -0,0 +1,15 @@
+from typing import List, Optional
+
+from pydantic import Field
+
+from app.utils.schema import BaseModel
+
+
+class ReplayRequest(BaseModel):
+    ids: Optional[List[str]] = Field(
+        default=None, description="dead letter task ids, replay all if empty"
+    )
+
+
+class ReplayResponse(BaseModel):
+    replayed: int
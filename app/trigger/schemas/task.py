@@ -1,8 +1,9 @@
 import time
-from typing import Any, Optional
+from typing import Any, List, Optional
 
 from pydantic import Field
 
+from app.config import settings
 from app.trigger.enums import TaskAction, TaskStatus
 from app.utils.schema import BaseModel
 
@@ -55,3 +56,24 @@ class Task(BaseModel):
     def awake(self):
         with self._lock:
             self._lock.notify_all()
+
+
+class TaskQuery(BaseModel):
+    status: Optional[TaskStatus] = Field(description="task status")
+    action: Optional[TaskAction] = Field(description="task action")
+    notify_hook: Optional[str] = Field(description="notify hook")
+    start_time: Optional[int] = Field(description="submitted from, in ms")
+    end_time: Optional[int] = Field(description="submitted until, in ms")
+
+
+class TaskBatchRequest(BaseModel):
+    ids: List[str] = Field(
+        description="task ids",
+        min_items=1,
+        max_items=settings.TASK_BATCH_MAX_SIZE,
+    )
+
+
+class TaskBatchResponse(BaseModel):
+    tasks: List[Task]
+    missing: List[str] = Field(description="ids of unknown tasks")
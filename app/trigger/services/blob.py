@@ -0,0 +1,44 @@
+import hashlib
+from typing import Optional
+
+import redis.asyncio as async_redis
+
+from app.config import settings
+from app.utils.redis import async_redis_client
+
+
+class BlobStoreService:
+    """Content addressed store for image bytes, queued tasks carry the ref"""
+
+    KEY_PREFIX = "mj-blob:"
+
+    def __init__(
+        self,
+        redis_client: async_redis.Redis,
+        timeout: int = settings.BLOB_STORE_EXPIRE_SECONDS,
+    ):
+        self.timeout = timeout
+        self.redis_client = redis_client
+
+    def key(self, ref: str) -> str:
+        return self.KEY_PREFIX + ref
+
+    @staticmethod
+    def make_ref(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    async def put(self, data: bytes) -> str:
+        ref = self.make_ref(data)
+        # identical content is only written once, just refresh its ttl
+        if not await self.redis_client.expire(self.key(ref), self.timeout):
+            await self.redis_client.set(self.key(ref), data, ex=self.timeout)
+        return ref
+
+    async def get(self, ref: str) -> Optional[bytes]:
+        return await self.redis_client.get(self.key(ref))
+
+    async def delete(self, ref: str):
+        await self.redis_client.delete(self.key(ref))
+
+
+blob_store_service = BlobStoreService(async_redis_client)
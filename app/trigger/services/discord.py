@@ -1,31 +1,64 @@
+import hashlib
 import json
 import random
 import uuid
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional, Union
 
 import aiohttp
+from fastapi import UploadFile
 
-from app.config import settings
+from app.config import DiscordAccount, settings
 from app.errors import DiscordBizError
 from app.trigger.schemas.discord import (
     DiscordPayload,
     DiscordType,
     UploadResult,
 )
+from app.trigger.services.blob import blob_store_service
+from app.utils.cache import LRUCache
 from app.utils.exception import APPException
-from app.utils.http import FetchMethod, fetch
+from app.utils.http import FetchMethod, UploadStream, create_session, fetch
 from app.utils.random import random_filename, randome_nonce
 
 
 class DiscordService:
+    """Midjourney commands sent as one discord account"""
+
     TRIGGER_URL = "https://discord.com/api/v9/interactions"
-    UPLOAD_ATTACHMENT_URL = f"https://discord.com/api/v9/channels/{settings.DISCORD_CHANNEL_ID}/attachments"
-    SEND_MESSAGE_URL = f"https://discord.com/api/v9/channels/{settings.DISCORD_CHANNEL_ID}/messages"
+    CHANNEL_URL = "https://discord.com/api/v9/channels/{channel_id}"
+
+    def __init__(self, account: DiscordAccount):
+        self.account = account
+        channel_url = self.CHANNEL_URL.format(channel_id=account.channel_id)
+        self.upload_attachment_url = f"{channel_url}/attachments"
+        self.send_message_url = f"{channel_url}/messages"
+        self.headers = {
+            "Content-Type": "application/json",
+            "Authorization": account.user_token,
+        }
+        self.session: Optional[aiohttp.ClientSession] = None
+        # cdn urls of uploaded images, keyed by "<sha256>.<file_type>"
+        self.upload_cache = LRUCache(
+            max_size=settings.DISCORD_ATTACHMENT_CACHE_SIZE,
+            ttl=settings.DISCORD_ATTACHMENT_CACHE_SECONDS,
+        )
 
-    HEADERS = {
-        "Content-Type": "application/json",
-        "Authorization": settings.DISCORD_USER_TOKEN,
-    }
+    async def setup(self):
+        """Open the app-lifetime session shared by all discord requests"""
+        if self.session and not self.session.closed:
+            return
+        self.session = create_session(
+            limit=settings.DISCORD_HTTP_POOL_SIZE,
+            limit_per_host=settings.DISCORD_HTTP_POOL_SIZE_PER_HOST,
+            keepalive_timeout=settings.DISCORD_HTTP_KEEPALIVE_SECONDS,
+            ttl_dns_cache=settings.DISCORD_HTTP_DNS_CACHE_SECONDS,
+            timeout=settings.DISCORD_HTTP_TIMEOUT_SECONDS,
+        )
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+            self.session = None
 
     async def request(
         self,
@@ -34,11 +67,26 @@ class DiscordService:
         headers: Dict[str, Any] = None,
         method=FetchMethod.post,
         is_json: bool = True,
+        raise_for_status: bool = False,
     ):
         if headers is None:
-            headers = self.HEADERS
+            headers = self.headers
+        if self.session and not self.session.closed:
+            return await fetch(
+                self.session,
+                url,
+                data=data,
+                headers=headers,
+                method=method,
+                is_json=is_json,
+                raise_for_status=raise_for_status,
+            )
+
+        # no shared session outside of the app lifetime (e.g. scripts)
         async with aiohttp.ClientSession(
-            timeout=aiohttp.ClientTimeout(total=30),
+            timeout=aiohttp.ClientTimeout(
+                total=settings.DISCORD_HTTP_TIMEOUT_SECONDS
+            ),
             headers=headers,
         ) as session:
             return await fetch(
@@ -47,13 +95,38 @@ class DiscordService:
                 data=data,
                 method=method,
                 is_json=is_json,
+                raise_for_status=raise_for_status,
             )
 
-    async def put_attachment(self, url: str, image: bytes):
+    @staticmethod
+    def stream(image: UploadFile) -> UploadStream:
+        return UploadStream(
+            image,
+            chunk_size=settings.UPLOAD_CHUNK_SIZE,
+            max_size=settings.UPLOAD_MAX_SIZE,
+        )
+
+    async def digest(self, image: Union[bytes, UploadFile]) -> str:
+        if isinstance(image, bytes):
+            return hashlib.sha256(image).hexdigest()
+        return await self.stream(image).sha256()
+
+    async def put_attachment(
+        self,
+        url: str,
+        image: Union[bytes, UploadFile],
+        file_size: int = None,
+    ):
         headers = {"Content-Type": "image/png"}
+        data = image
+        if not isinstance(image, bytes):
+            data = self.stream(image)
+            # a known length avoids a chunked PUT to the presigned url
+            if file_size:
+                headers["Content-Length"] = str(file_size)
         return await self.request(
             url=url,
-            data=image,
+            data=data,
             headers=headers,
             method=FetchMethod.put,
             is_json=False,
@@ -63,11 +136,16 @@ class DiscordService:
         self,
         file_size: int,
         file_type: str,
-        image: bytes,
+        image: Union[bytes, UploadFile],
     ):
+        """Upload to discord storage and return the one-time upload slot.
+
+        The slot is consumed by the interaction or message that attaches
+        it, so it is never reused.
+        """
         filename = random_filename(16) + "." + file_type
         upload_attachment_resp = await self.request(
-            url=self.UPLOAD_ATTACHMENT_URL,
+            url=self.upload_attachment_url,
             data=json.dumps(
                 {
                     "files": [
@@ -91,17 +169,29 @@ class DiscordService:
         upload_filename = presigned_attachment.pop("upload_filename")
 
         # upload image
-        await self.put_attachment(upload_url, image)
+        await self.put_attachment(upload_url, image, file_size)
         return filename, upload_filename
 
+    async def presigned_upload_blob(
+        self, file_size: int, file_type: str, image_ref: str
+    ):
+        return await self.presigned_upload(
+            file_size, file_type, await self.load_blob(image_ref)
+        )
+
     async def upload(
         self,
         file_size: int,
         file_type: str,
-        image: bytes,
+        image: Union[bytes, UploadFile],
     ) -> UploadResult:
         """Upload image to discord and return the url"""
 
+        digest = await self.digest(image)
+        cache_key = f"{digest}.{file_type}"
+        if cached := self.upload_cache.get(cache_key):
+            return cached
+
         filename, upload_filename = await self.presigned_upload(
             file_size, file_type, image
         )
@@ -114,25 +204,35 @@ class DiscordService:
                     "uploaded_filename": upload_filename,
                 }
             ],
-            channel_id=settings.DISCORD_CHANNEL_ID,
+            channel_id=self.account.channel_id,
             nonce=randome_nonce(),
             sticker_ids=[],
             type=0,
             content="",
         )
         response = await self.request(
-            self.SEND_MESSAGE_URL,
+            self.send_message_url,
             data=json.dumps(sent_msg_payload),
         )
         attachment = response["attachments"][0]
-        return UploadResult(
+        result = UploadResult(
             filename=attachment.get("filename"),
             file_url=attachment.get("url"),
         )
+        self.upload_cache.set(cache_key, result)
+        return result
+
+    def payload(self, **kwargs) -> DiscordPayload:
+        return DiscordPayload(
+            guild_id=self.account.guild_id,
+            channel_id=self.account.channel_id,
+            session_id=self.account.session_id,
+            **kwargs,
+        )
 
     async def imagine(self, prompt: str):
         version = "1118961510123847772"
-        payload = DiscordPayload(
+        payload = self.payload(
             type=DiscordType.IMAGINE.value,
             nonce=randome_nonce(),
             data={
@@ -169,6 +269,7 @@ class DiscordService:
             url=self.TRIGGER_URL,
             data=json.dumps(payload.dict()),
             is_json=False,
+            raise_for_status=True,
         )
         return resp
 
@@ -183,7 +284,7 @@ class DiscordService:
             "message_flags": 0,
             "message_id": msg_id,
         }
-        payload = DiscordPayload(
+        payload = self.payload(
             type=DiscordType.UPSCALE.value,
             nonce=randome_nonce(),
             data={
@@ -193,7 +294,10 @@ class DiscordService:
         ).dict()
         payload.update(kwargs)
         return await self.request(
-            url=self.TRIGGER_URL, data=json.dumps(payload), is_json=False
+            url=self.TRIGGER_URL,
+            data=json.dumps(payload),
+            is_json=False,
+            raise_for_status=True,
         )
 
     async def variation(self, msg_id: str, index: int, msg_hash: str):
@@ -201,7 +305,7 @@ class DiscordService:
             "message_flags": 0,
             "message_id": msg_id,
         }
-        payload = DiscordPayload(
+        payload = self.payload(
             type=DiscordType.VARIATION.value,
             nonce=randome_nonce(),
             data={
@@ -210,14 +314,19 @@ class DiscordService:
             },
         ).dict()
         payload.update(kwargs)
-        await self.request(url=self.TRIGGER_URL, data=payload)
+        return await self.request(
+            url=self.TRIGGER_URL,
+            data=json.dumps(payload),
+            is_json=False,
+            raise_for_status=True,
+        )
 
     async def reset(self, msg_id: str, msg_hash: str):
         kwargs = {
             "message_flags": 0,
             "message_id": msg_id,
         }
-        payload = DiscordPayload(
+        payload = self.payload(
             type=DiscordType.RESET.value,
             nonce=randome_nonce(),
             data={
@@ -226,15 +335,24 @@ class DiscordService:
             },
         ).dict()
         payload.update(kwargs)
-        await self.request(url=self.TRIGGER_URL, data=payload)
+        return await self.request(
+            url=self.TRIGGER_URL,
+            data=json.dumps(payload),
+            is_json=False,
+            raise_for_status=True,
+        )
 
-    async def describe(
-        self, file_size: int, file_type: str, image_bytes: bytes
-    ):
-        filename, upload_filename = await self.presigned_upload(
-            file_size, file_type, image_bytes
+    async def load_blob(self, image_ref: str) -> bytes:
+        image_bytes = await blob_store_service.get(image_ref)
+        if image_bytes is None:
+            raise APPException(DiscordBizError.ATTACHMENT_EXPIRED)
+        return image_bytes
+
+    async def describe(self, file_size: int, file_type: str, image_ref: str):
+        filename, upload_filename = await self.presigned_upload_blob(
+            file_size, file_type, image_ref
         )
-        payload = DiscordPayload(
+        payload = self.payload(
             type=DiscordType.DESCRIBE.value,
             nonce=randome_nonce(),
             data={
@@ -272,7 +390,12 @@ class DiscordService:
                 ],
             },
         )
-        resp = await self.request(url=self.TRIGGER_URL, data=payload.dict())
+        resp = await self.request(
+            url=self.TRIGGER_URL,
+            data=json.dumps(payload.dict()),
+            is_json=False,
+            raise_for_status=True,
+        )
         return resp
         ...
 
@@ -280,18 +403,18 @@ class DiscordService:
         self,
         file_size: int,
         file_type: str,
-        image_bytes: bytes,
+        image_ref: str,
         file_size2: int,
         file_type2: str,
-        image_bytes2: bytes,
+        image_ref2: str,
     ):
-        filename, upload_filename = await self.presigned_upload(
-            file_size, file_type, image_bytes
+        filename, upload_filename = await self.presigned_upload_blob(
+            file_size, file_type, image_ref
         )
-        filename2, upload_filename2 = await self.presigned_upload(
-            file_size2, file_type2, image_bytes2
+        filename2, upload_filename2 = await self.presigned_upload_blob(
+            file_size2, file_type2, image_ref2
         )
-        payload = DiscordPayload(
+        payload = self.payload(
             type=DiscordType.BLEND.value,
             nonce=randome_nonce(),
             data={
@@ -368,7 +491,40 @@ class DiscordService:
                 ],
             },
         ).dict()
-        await self.request(self.TRIGGER_URL, data=payload)
+        return await self.request(
+            url=self.TRIGGER_URL,
+            data=json.dumps(payload),
+            is_json=False,
+            raise_for_status=True,
+        )
+
+
+class DiscordServicePool:
+    """One DiscordService per configured account, keyed by account name"""
+
+    def __init__(self, accounts: List[DiscordAccount]):
+        self.services: Dict[str, DiscordService] = {
+            account.name: DiscordService(account) for account in accounts
+        }
+        self.default = next(iter(self.services.values()))
+
+    @property
+    def accounts(self) -> List[DiscordAccount]:
+        return [service.account for service in self.services.values()]
+
+    def get(self, name: Optional[str]) -> DiscordService:
+        # tasks queued before the pool existed carry no account
+        return self.services.get(name, self.default)
+
+    async def setup(self):
+        for service in self.services.values():
+            await service.setup()
+
+    async def close(self):
+        for service in self.services.values():
+            await service.close()
 
 
-discord_service = DiscordService()
+discord_pool = DiscordServicePool(settings.DISCORD_ACCOUNTS)
+# uploads and scripts are served by the first account
+discord_service = discord_pool.default
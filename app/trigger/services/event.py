@@ -0,0 +1,126 @@
+import asyncio
+import json
+from typing import AsyncIterator, Dict, Optional, Set
+
+import redis.asyncio as async_redis
+
+from app.config import settings
+from app.trigger.enums import TaskStatus
+from app.trigger.schemas.task import Task
+from app.trigger.services.store import task_store_service
+from app.utils.logger import setup_logger
+from app.utils.redis import async_redis_client
+
+logger = setup_logger("TaskEventService")
+
+
+class TaskEventService:
+    """Task state changes fanned out from one redis pub/sub subscription.
+
+    Every transition is published to a single channel. Each API worker
+    subscribes once and hands the changes to bounded per-watcher queues,
+    so the number of redis subscriptions does not grow with the clients.
+    """
+
+    CHANNEL = "mj-task:events"
+    FINISHED_STATUS = (TaskStatus.SUCCESS.value, TaskStatus.FAILURE.value)
+
+    def __init__(
+        self,
+        redis_client: async_redis.Redis,
+        queue_size: int = settings.TASK_EVENT_QUEUE_SIZE,
+        heartbeat: int = settings.TASK_EVENT_HEARTBEAT_SECONDS,
+    ):
+        self.redis_client = redis_client
+        self.queue_size = queue_size
+        self.heartbeat = heartbeat
+        self._watchers: Dict[str, Set[asyncio.Queue]] = {}
+        self._listener: Optional[asyncio.Task] = None
+
+    async def publish(self, *tasks: Task):
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            for task in tasks:
+                pipe.publish(self.CHANNEL, task.json())
+            await pipe.execute()
+
+    async def start(self):
+        if not self._listener:
+            self._listener = asyncio.create_task(self._listen_forever())
+
+    async def close(self):
+        if self._listener:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+
+    async def _listen_forever(self):
+        while True:
+            pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self.CHANNEL)
+                # changes may have been missed while unsubscribed
+                await self._resync()
+                async for message in pubsub.listen():
+                    self.dispatch(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Task event subscription failed: {e}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.close()
+
+    async def _resync(self):
+        for task_id in list(self._watchers):
+            task = await task_store_service.get(task_id)
+            if task:
+                self._deliver(task)
+
+    def dispatch(self, data: bytes):
+        try:
+            payload = json.loads(data)
+            # most events have nobody watching, skip building the model
+            if payload["id"] in self._watchers:
+                self._deliver(Task(**payload))
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning(f"Drop task event: {e}")
+
+    def _deliver(self, task: Task):
+        for queue in self._watchers.get(task.id, ()):
+            if queue.full():
+                # a slow watcher only needs the latest state
+                queue.get_nowait()
+            queue.put_nowait(task)
+
+    async def watch(self, task_id: str) -> AsyncIterator[Optional[Task]]:
+        """Yield the current task state and then every change to it.
+
+        ``None`` is yielded when nothing changed for a heartbeat interval,
+        and the iteration ends once the task is finished or expired.
+        """
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._watchers.setdefault(task_id, set()).add(queue)
+        try:
+            # subscribe first so no change is lost between the two
+            task = await task_store_service.get(task_id)
+            if not task:
+                return
+            yield task
+            while task.status not in self.FINISHED_STATUS:
+                try:
+                    task = await asyncio.wait_for(
+                        queue.get(), timeout=self.heartbeat
+                    )
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                yield task
+        finally:
+            queue_set = self._watchers.get(task_id)
+            if queue_set is not None:
+                queue_set.discard(queue)
+                if not queue_set:
+                    del self._watchers[task_id]
+
+
+task_event_service = TaskEventService(async_redis_client)
@@ -1,4 +1,7 @@
 import os
+import re
+import time
+from typing import Dict, Iterable, List, Optional
 
 from app.config import settings
 
@@ -8,22 +11,94 @@ class MidjourneyService:
         settings.BASE_DIR, "templates", "banned-words.txt"
     )
 
-    def __init__(self):
+    def __init__(
+        self, reload_interval: int = settings.BANNED_WORDS_RELOAD_SECONDS
+    ):
         self.banned_words = []
-        print(
-            "Loading banned words...", MidjourneyService.BANNED_WORDS_FILE_PATH
+        self.banned_pattern: Optional[re.Pattern] = None
+        self.reload_interval = reload_interval
+        self._mtime = None
+        self._checked_at = time.monotonic()
+        self.load_banned_words()
+
+    # a whole word is not preceded or followed by a letter or a digit
+    WORD_START = r"(?<![a-z0-9])"
+    WORD_END = r"(?![a-z0-9])"
+
+    @classmethod
+    def compile_banned_words(cls, words: List[str]) -> Optional[re.Pattern]:
+        """Build one pattern that only matches whole words.
+
+        The words are merged into a prefix tree, so the regex engine tries
+        a single branch per character instead of every word in turn.
+        Entries starting or ending with punctuation (e.g. "-edge") are
+        fragments, so no boundary is required on that side.
+        """
+        words = set(words)
+        if not words:
+            return None
+        words_trie = cls.trie(word for word in words if word[0].isalnum())
+        fragments_trie = cls.trie(
+            word for word in words if not word[0].isalnum()
         )
-        with open(MidjourneyService.BANNED_WORDS_FILE_PATH, "r") as f:
-            self.banned_words += f.read().splitlines()
+        alternatives = []
+        if words_trie:
+            alternatives.append(cls.WORD_START + cls.trie_pattern(words_trie))
+        if fragments_trie:
+            alternatives.append(cls.trie_pattern(fragments_trie))
+        return re.compile("|".join(alternatives), re.IGNORECASE)
+
+    @staticmethod
+    def trie(words: Iterable[str]) -> Dict:
+        root = {}
+        for word in words:
+            node = root
+            for char in word:
+                node = node.setdefault(char, {})
+            # an empty key marks the end of a word
+            node[""] = {}
+        return root
+
+    @classmethod
+    def trie_pattern(cls, node: Dict, last: str = "") -> str:
+        alternatives = []
+        for char, child in sorted(node.items()):
+            if char:
+                alternatives.append(
+                    re.escape(char) + cls.trie_pattern(child, char)
+                )
+            else:
+                alternatives.append(cls.WORD_END if last.isalnum() else "")
+        if len(alternatives) == 1:
+            return alternatives[0]
+        return "(?:" + "|".join(alternatives) + ")"
+
+    def load_banned_words(self):
+        path = MidjourneyService.BANNED_WORDS_FILE_PATH
+        print("Loading banned words...", path)
+        self._mtime = os.stat(path).st_mtime
+        with open(path, "r") as f:
+            words = [word.strip().lower() for word in f.read().splitlines()]
+        self.banned_words = [word for word in words if word]
+        self.banned_pattern = self.compile_banned_words(self.banned_words)
+
+    def reload_if_changed(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(MidjourneyService.BANNED_WORDS_FILE_PATH).st_mtime
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self.load_banned_words()
 
     def is_banned(self, prompt_en: str):
-        exist = False
-        prompt_en = prompt_en.lower()
-        for word in self.banned_words:
-            if word in prompt_en:
-                exist = True
-                break
-        return exist
+        self.reload_if_changed()
+        if not self.banned_pattern:
+            return False
+        return bool(self.banned_pattern.search(prompt_en))
 
 
 midjourney_service = MidjourneyService()
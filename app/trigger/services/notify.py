@@ -1,75 +1,402 @@
+import asyncio
 import json
 import logging
-import threading
-from concurrent.futures import ThreadPoolExecutor
-from datetime import timedelta
-from functools import partial
+import random
+import time
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
 
-import requests
+import redis.asyncio as async_redis
+from aiohttp import ClientError, ClientSession
 
+from app.config import settings
+from app.trigger.enums import TaskStatus
 from app.trigger.schemas.task import Task
+from app.utils.http import create_session
+from app.utils.redis import async_redis_client
 
 
 class NotifyService:
-    def __init__(self, max_workers: int = 5):
-        self.executor = ThreadPoolExecutor(max_workers=max_workers)
-        self.task_locks = {}
-        self.locks_cleanup_interval = timedelta(hours=1)
+    """Webhook delivery through a durable redis outbox.
 
-    def _cleanup_task_lock(self, task_id):
-        self.task_locks.pop(task_id, None)
+    Every task has one mailbox (``notify:mailbox:<task_id>``) holding only
+    its latest state, so superseded progress events are never sent. The
+    outbox (``notify:outbox``) is a sorted set of task ids scored by the
+    next attempt time. At most one delivery per task is in flight, and a
+    state written meanwhile is delivered after it, which keeps the order.
+    Failed deliveries back off exponentially and end up in the dead
+    letter hash, from which they can be replayed.
+    """
 
-    def notify_task_change(self, task: Task) -> None:
+    OUTBOX = "notify:outbox"
+    MAILBOX_PREFIX = "notify:mailbox:"
+    DEAD_LETTERS = "notify:dead"
+    SIGNAL = "notify:outbox:signal"
+
+    ENQUEUE_SCRIPT = """
+    local version = redis.call("HINCRBY", KEYS[2], "version", 1)
+    redis.call(
+        "HSET", KEYS[2],
+        "notify_hook", ARGV[2], "body", ARGV[3], "progress", ARGV[5]
+    )
+    redis.call("EXPIRE", KEYS[2], ARGV[7])
+    redis.call("RPUSH", KEYS[3], 1)
+    redis.call("LTRIM", KEYS[3], 0, 0)
+    -- an in-flight delivery reschedules the newer state when it is done
+    if redis.call("HEXISTS", KEYS[2], "inflight") == 1 then
+        return version
+    end
+    local now = tonumber(ARGV[4])
+    local due = now
+    if ARGV[5] == "1" then
+        local last_sent = redis.call("HGET", KEYS[2], "last_sent")
+        due = math.max(now, tonumber(last_sent or 0) + tonumber(ARGV[6]))
+    end
+    local score = redis.call("ZSCORE", KEYS[1], ARGV[1])
+    local attempts = tonumber(redis.call("HGET", KEYS[2], "attempts") or 0)
+    -- a failing hook keeps its backoff even if a newer state arrives
+    if not score or (attempts == 0 and tonumber(score) > due) then
+        redis.call("ZADD", KEYS[1], due, ARGV[1])
+    end
+    return version
+    """
+
+    # hand out due mailboxes and hide them until the lease expires, so a
+    # crashed worker's deliveries are picked up again
+    CLAIM_SCRIPT = """
+    local now = tonumber(ARGV[1])
+    local ids = redis.call(
+        "ZRANGEBYSCORE", KEYS[1], "-inf", now, "LIMIT", 0, ARGV[3]
+    )
+    local claimed = {}
+    for _, id in ipairs(ids) do
+        local mailbox = ARGV[4] .. id
+        local message = redis.call(
+            "HMGET", mailbox, "notify_hook", "body", "version", "attempts"
+        )
+        if not message[2] then
+            redis.call("ZREM", KEYS[1], id)
+        else
+            redis.call("ZADD", KEYS[1], now + tonumber(ARGV[2]), id)
+            redis.call("HSET", mailbox, "inflight", 1)
+            table.insert(claimed, id)
+            table.insert(claimed, message[1])
+            table.insert(claimed, message[2])
+            table.insert(claimed, message[3])
+            table.insert(claimed, message[4] or "0")
+        end
+    end
+    return claimed
+    """
+
+    ACK_SCRIPT = """
+    redis.call("HDEL", KEYS[2], "inflight")
+    redis.call("HSET", KEYS[2], "last_sent", ARGV[3], "attempts", 0)
+    local version = tonumber(redis.call("HGET", KEYS[2], "version") or 0)
+    local progress = redis.call("HGET", KEYS[2], "progress") == "1"
+    if version <= tonumber(ARGV[2]) then
+        redis.call("ZREM", KEYS[1], ARGV[1])
+        if progress then
+            -- remember last_sent to pace the next progress event
+            redis.call("HDEL", KEYS[2], "body")
+        else
+            redis.call("DEL", KEYS[2])
+        end
+        return 0
+    end
+    local due = tonumber(ARGV[3])
+    if progress then
+        due = due + tonumber(ARGV[4])
+    end
+    redis.call("ZADD", KEYS[1], due, ARGV[1])
+    return 1
+    """
+
+    FAIL_SCRIPT = """
+    redis.call("HDEL", KEYS[2], "inflight")
+    local attempts = redis.call("HINCRBY", KEYS[2], "attempts", 1)
+    redis.call("HSET", KEYS[2], "last_error", ARGV[5])
+    if attempts < tonumber(ARGV[4]) then
+        redis.call("ZADD", KEYS[1], ARGV[3], ARGV[1])
+        return 0
+    end
+    local message = redis.call(
+        "HMGET", KEYS[2], "notify_hook", "body", "progress"
+    )
+    redis.call("HSET", KEYS[3], ARGV[1], cjson.encode({
+        task_id = ARGV[1],
+        notify_hook = message[1],
+        body = message[2],
+        progress = message[3],
+        attempts = attempts,
+        last_error = ARGV[5],
+        dead_time = tonumber(ARGV[2]),
+    }))
+    redis.call("DEL", KEYS[2])
+    redis.call("ZREM", KEYS[1], ARGV[1])
+    return 1
+    """
+
+    DEFER_SCRIPT = """
+    redis.call("HDEL", KEYS[2], "inflight")
+    redis.call("ZADD", KEYS[1], ARGV[2], ARGV[1])
+    """
+
+    def __init__(
+        self,
+        redis_client: async_redis.Redis,
+        host_concurrency: int = settings.NOTIFY_HOST_CONCURRENCY,
+        timeout: int = settings.NOTIFY_TIMEOUT_SECONDS,
+    ):
+        self.redis_client = redis_client
+        self.host_concurrency = host_concurrency
+        self.timeout = timeout
+        self.enqueue_script = redis_client.register_script(self.ENQUEUE_SCRIPT)
+        self.claim_script = redis_client.register_script(self.CLAIM_SCRIPT)
+        self.ack_script = redis_client.register_script(self.ACK_SCRIPT)
+        self.fail_script = redis_client.register_script(self.FAIL_SCRIPT)
+        self.defer_script = redis_client.register_script(self.DEFER_SCRIPT)
+        # one pooled session and in-flight limit per destination host,
+        # so a slow hook can only exhaust its own slots
+        self.sessions: Dict[str, ClientSession] = {}
+        self.host_semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._worker: Optional[asyncio.Task] = None
+        self._deliveries = set()
+
+    def mailbox(self, task_id: str) -> str:
+        return self.MAILBOX_PREFIX + task_id
+
+    @staticmethod
+    def now() -> int:
+        return int(round(time.time() * 1000))
+
+    async def notify_task_change(self, task: Task) -> None:
         notify_hook = task.notify_hook
         if not notify_hook:
             return
 
-        task_id = task.id
-        task_lock = self.task_locks.setdefault(task_id, threading.Lock())
-
         try:
             params_str = json.dumps(task.dict())
-            post_request = partial(self._post_json, notify_hook, params_str)
-            future = self.executor.submit(
-                self._execute_post_request,
-                task_lock,
-                post_request,
-            )
+        except (TypeError, ValueError) as e:
+            logging.warning(f"Failed to convert task to JSON: {e}")
+            return
+
+        progress = task.status not in (
+            TaskStatus.SUCCESS.value,
+            TaskStatus.FAILURE.value,
+        )
+        await self.enqueue(task.id, notify_hook, params_str, progress)
+
+    async def enqueue(
+        self, task_id: str, notify_hook: str, body: str, progress: bool
+    ):
+        """Replace the task's pending state, last write wins"""
+        await self.enqueue_script(
+            keys=[self.OUTBOX, self.mailbox(task_id), self.SIGNAL],
+            args=[
+                task_id,
+                notify_hook,
+                body,
+                self.now(),
+                "1" if progress else "0",
+                settings.NOTIFY_PROGRESS_INTERVAL_SECONDS * 1000,
+                settings.NOTIFY_MAILBOX_EXPIRE_SECONDS,
+            ],
+        )
 
-            # Use add_done_callback to clean up the task_lock after the task is completed
-            future.add_done_callback(
-                lambda f: self.task_locks.pop(task_id, None)
+    async def start(self):
+        if self._worker and not self._worker.done():
+            return
+        self._worker = asyncio.create_task(self._deliver_forever())
+
+    async def _deliver_forever(self):
+        while True:
+            try:
+                if not await self.deliver_due():
+                    await self.redis_client.blpop(
+                        self.SIGNAL, timeout=settings.NOTIFY_POLL_SECONDS
+                    )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f"Notification outbox failed: {e}")
+                await asyncio.sleep(settings.NOTIFY_POLL_SECONDS)
+
+    async def deliver_due(self) -> int:
+        """Start delivering due mailboxes, return how many were claimed"""
+        free = settings.NOTIFY_OUTBOX_CONCURRENCY - len(self._deliveries)
+        if free <= 0:
+            await asyncio.wait(
+                self._deliveries, return_when=asyncio.FIRST_COMPLETED
             )
-        except json.JSONDecodeError as e:
-            logging.warn(f"Failed to convert task to JSON: {e}")
+            return 1
+        claimed = await self.claim_script(
+            keys=[self.OUTBOX],
+            args=[
+                self.now(),
+                settings.NOTIFY_OUTBOX_LEASE_SECONDS * 1000,
+                free,
+                self.MAILBOX_PREFIX,
+            ],
+        )
+        for i in range(0, len(claimed), 5):
+            task_id, notify_hook, body, version, attempts = (
+                item.decode("utf-8") for item in claimed[i : i + 5]
+            )
+            delivery = asyncio.create_task(
+                self._safe_attempt(
+                    task_id, notify_hook, body, int(version), int(attempts)
+                )
+            )
+            self._deliveries.add(delivery)
+            delivery.add_done_callback(self._deliveries.discard)
+        return len(claimed) // 5
+
+    async def _safe_attempt(self, task_id: str, *args):
+        try:
+            await self._attempt(task_id, *args)
         except Exception as e:
-            logging.warn(f"Failed to notify task change: {e}")
+            # the mailbox stays leased in the outbox and is retried
+            logging.warning(f"Task {task_id} notification errored: {e!r}")
 
-    def _execute_post_request(
-        self, task_lock: threading.Lock, post_request: callable
+    async def _attempt(
+        self,
+        task_id: str,
+        notify_hook: str,
+        body: str,
+        version: int,
+        attempts: int,
     ):
-        with task_lock:
+        keys = [self.OUTBOX, self.mailbox(task_id)]
+        host = urlsplit(notify_hook).netloc
+        if self._host_semaphore(host).locked():
+            # the host is saturated, don't let it hold outbox slots
+            await self.defer_script(
+                keys=keys,
+                args=[
+                    task_id,
+                    self.now() + settings.NOTIFY_POLL_SECONDS * 1000,
+                ],
+            )
+            return
+
+        error = await self.deliver(notify_hook, body)
+        if error is None:
+            await self.ack_script(
+                keys=keys,
+                args=[
+                    task_id,
+                    version,
+                    self.now(),
+                    settings.NOTIFY_PROGRESS_INTERVAL_SECONDS * 1000,
+                ],
+            )
+            return
+
+        dead = await self.fail_script(
+            keys=keys + [self.DEAD_LETTERS],
+            args=[
+                task_id,
+                self.now(),
+                self.now() + int(self.backoff(attempts + 1) * 1000),
+                settings.NOTIFY_MAX_ATTEMPTS,
+                error,
+            ],
+        )
+        if dead:
+            logging.warning(f"Task {task_id} notification dead lettered")
+
+    @staticmethod
+    def backoff(attempts: int) -> float:
+        delay = min(
+            settings.NOTIFY_RETRY_BASE_SECONDS * 2 ** (attempts - 1),
+            settings.NOTIFY_RETRY_MAX_SECONDS,
+        )
+        # jitter keeps retries of one outage from firing together
+        return delay + random.uniform(0, settings.NOTIFY_RETRY_BASE_SECONDS)
+
+    def _host_semaphore(self, host: str) -> asyncio.Semaphore:
+        return self.host_semaphores.setdefault(
+            host, asyncio.Semaphore(self.host_concurrency)
+        )
+
+    def _get_session(self, host: str) -> ClientSession:
+        session = self.sessions.get(host)
+        if not session or session.closed:
+            session = self.sessions[host] = create_session(
+                limit=self.host_concurrency,
+                limit_per_host=self.host_concurrency,
+                timeout=self.timeout,
+                headers={"Content-Type": "application/json"},
+            )
+        return session
+
+    async def deliver(
+        self, notify_hook: str, params_json: str
+    ) -> Optional[str]:
+        """Post the notification, return the error if it failed"""
+        host = urlsplit(notify_hook).netloc
+        async with self._host_semaphore(host):
             try:
-                response = post_request()
-                if response.status_code == requests.codes.OK:
-                    logging.debug(
-                        f"Task change notification successful, status: {response.status_code}, URL: {response.url}"
-                    )
-                else:
+                async with self._get_session(host).post(
+                    notify_hook, data=params_json
+                ) as response:
+                    if response.ok:
+                        logging.debug(
+                            f"Task change notification successful, status: {response.status}, URL: {response.url}"
+                        )
+                        return None
                     logging.warning(
-                        f"Task change notification failed, status: {response.status_code}, URL: {response.url}"
+                        f"Task change notification failed, status: {response.status}, URL: {response.url}"
                     )
-            except requests.RequestException as e:
-                logging.warning(f"Task change notification failed: {e}")
+                    return f"status {response.status}"
+            except (ClientError, asyncio.TimeoutError) as e:
+                logging.warning(f"Task change notification failed: {e!r}")
+                return repr(e)
 
-    def _post_json(
-        self, notify_hook: str, params_json: str
-    ) -> requests.Response:
-        headers = {"Content-Type": "application/json"}
-        response = requests.post(
-            notify_hook, headers=headers, data=params_json
+    async def dead_letters(self) -> List[Dict]:
+        messages = await self.redis_client.hvals(self.DEAD_LETTERS)
+        return sorted(
+            (json.loads(message) for message in messages),
+            key=lambda message: message["dead_time"],
         )
-        return response
+
+    async def replay(self, ids: Optional[List[str]] = None) -> int:
+        """Move dead letters back into the outbox with fresh attempts"""
+        if ids:
+            payloads = await self.redis_client.hmget(self.DEAD_LETTERS, ids)
+        else:
+            payloads = await self.redis_client.hvals(self.DEAD_LETTERS)
+        replayed = 0
+        for payload in payloads:
+            if payload is None:
+                continue
+            message = json.loads(payload)
+            if not await self.redis_client.hdel(
+                self.DEAD_LETTERS, message["task_id"]
+            ):
+                continue
+            await self.enqueue(
+                message["task_id"],
+                message["notify_hook"],
+                message["body"],
+                message["progress"] == "1",
+            )
+            replayed += 1
+        return replayed
+
+    async def close(self):
+        if self._worker:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+        # unfinished deliveries stay in the outbox and are retried
+        for delivery in self._deliveries:
+            delivery.cancel()
+        await asyncio.gather(*self._deliveries, return_exceptions=True)
+        for session in self.sessions.values():
+            await session.close()
+        self.sessions.clear()
 
 
-notify_service = NotifyService()
+notify_service = NotifyService(async_redis_client)
@@ -0,0 +1,58 @@
+import re
+from typing import NamedTuple, Optional
+
+
+class ParsedMessage(NamedTuple):
+    task_id: str
+    progress: Optional[int] = None
+    waiting: bool = False
+    msg_hash: str = ""
+
+
+class MessageParser:
+    """Single-pass parser for midjourney bot messages.
+
+    Messages of ours look like::
+
+        **<#task_id#> prompt** - <@user> (31%) (fast)
+        **<#task_id#> prompt** - <@user> (Waiting to start)
+        **<#task_id#> prompt** - Variations (Strong) by <@user> (12%) (fast)
+        **<#task_id#> prompt** - Remix (Subtle) by <@user> (46%)
+        **<#task_id#> prompt** - Image #1 <@user>
+
+    Progress and the waiting marker are the first ``(N%)`` or
+    ``(Waiting to start)`` after the last ``** - ``, so a prompt that
+    contains one does not confuse the parser.
+    """
+
+    MARKER = "<#"
+    WAITING = "Waiting to start"
+    PATTERN = re.compile(
+        r"<#(\w+)#>(?:.*\*\* - .*?\((?:(\d+)%|(" + WAITING + r"))\))?",
+        re.DOTALL,
+    )
+
+    def parse(
+        self, content: str, filename: Optional[str] = None
+    ) -> Optional[ParsedMessage]:
+        # most messages in the channel are not ours, reject them cheaply
+        if self.MARKER not in content:
+            return None
+        match = self.PATTERN.search(content)
+        if not match:
+            return None
+        task_id, progress, waiting = match.groups()
+        return ParsedMessage(
+            task_id=task_id,
+            progress=int(progress) if progress else None,
+            waiting=waiting is not None,
+            msg_hash=self.msg_hash(filename) if filename else "",
+        )
+
+    @staticmethod
+    def msg_hash(filename: str) -> str:
+        """``user_prompt_<hash>.png`` -> ``<hash>``"""
+        return filename.rpartition("_")[2].partition(".")[0]
+
+
+message_parser = MessageParser()
@@ -1,132 +1,569 @@
 import asyncio
 import json
-from typing import Dict, Optional
+import time
+from typing import Dict, List, Optional, Set
 
-import redis
+import redis.asyncio as async_redis
 
-from app.config import settings
+from app.config import DiscordAccount, settings
 from app.errors import TaskQueueBizError
 from app.trigger.enums import TaskStatus
 from app.trigger.schemas.task import Task
-from app.trigger.services.discord import discord_service
+from app.trigger.services.discord import discord_pool
+from app.trigger.services.event import task_event_service
 from app.trigger.services.notify import notify_service
 from app.trigger.services.store import task_store_service
 from app.utils.exception import APPException
+from app.utils.http import FetchStatusError
 from app.utils.logger import setup_logger
+from app.utils.redis import async_redis_client
 
 logger = setup_logger("TaskQueueService")
 
 
 class SharedQueue:
-    def __init__(self, name: str = "waiting"):
-        self.redis_client = redis.Redis(
-            settings.REDIS_HOST, settings.REDIS_PORT, db=1
-        )
+    # push only while the queue is below its size limit
+    PUSH_SCRIPT = """
+    if redis.call("LLEN", KEYS[1]) >= tonumber(ARGV[1]) then
+        return 0
+    end
+    redis.call("RPUSH", KEYS[1], ARGV[2])
+    return 1
+    """
+
+    def __init__(
+        self,
+        name: str = "waiting",
+        redis_client: async_redis.Redis = async_redis_client,
+    ):
+        self.redis_client = redis_client
         self.name = name
+        self.push_script = redis_client.register_script(self.PUSH_SCRIPT)
 
-    def push(self, item: Dict):
-        self.redis_client.rpush(
-            self.name, json.dumps(item, ensure_ascii=False)
+    async def push(self, item: Dict, max_size: int = 0) -> bool:
+        data = json.dumps(item, ensure_ascii=False)
+        if not max_size:
+            await self.redis_client.rpush(self.name, data)
+            return True
+        return bool(
+            await self.push_script(keys=[self.name], args=[max_size, data])
         )
 
-    def pop(self):
-        data = self.redis_client.lpop(self.name)
+    async def pop(self):
+        data = await self.redis_client.lpop(self.name)
         if data and isinstance(data, bytes):
             return json.loads(data.decode("utf-8"))
         return None
 
-    def size(self):
-        return self.redis_client.llen(self.name)
+    async def size(self):
+        return await self.redis_client.llen(self.name)
 
 
-class SharedList:
-    def __init__(self, name: str = "running"):
-        self.redis_client = redis.Redis(
-            settings.REDIS_HOST, settings.REDIS_PORT, db=1
-        )
-        self.name = name
+class SharedHash:
+    """Running tasks kept as a redis hash of task_id -> lease info
+
+    Leases are only written by the dispatch script, which owns their
+    format. Adds and removals are also published on ``<name>:events`` as
+    ``add:<task_id>`` and ``remove:<task_id>``.
+    """
 
-    def add(self, task_id: str):
-        self.redis_client.lpush(self.name, task_id)
+    # fetch the task payload only if the task is still running
+    FIND_ONE_SCRIPT = """
+    if redis.call("HEXISTS", KEYS[1], ARGV[1]) == 1 then
+        return redis.call("HGETALL", KEYS[2])
+    end
+    return false
+    """
 
-    def remove(self, task_id: str):
-        self.redis_client.lrem(self.name, 0, task_id.encode("utf-8"))
+    def __init__(
+        self,
+        name: str = "running",
+        redis_client: async_redis.Redis = async_redis_client,
+    ):
+        self.redis_client = redis_client
+        self.name = name
+        self.events = f"{name}:events"
+        self.find_one_script = redis_client.register_script(
+            self.FIND_ONE_SCRIPT
+        )
 
-    def find_all(self):
-        return self.redis_client.lrange(self.name, 0, -1)
+    async def remove(self, task_id: str) -> bool:
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.hdel(self.name, task_id)
+            pipe.publish(self.events, f"remove:{task_id}")
+            removed, _ = await pipe.execute()
+        return bool(removed)
 
-    def find_one(self, task_id: str):
-        task_ids = [
+    async def ids(self) -> Set[str]:
+        return {
             task_id.decode("utf-8")
-            for task_id in self.redis_client.lrange(self.name, 0, -1)
-        ]
-        if task_id in task_ids:
-            return task_store_service.get(task_id)
-        return None
+            for task_id in await self.redis_client.hkeys(self.name)
+        }
+
+    async def find_all(self) -> Dict[str, Dict]:
+        leases = await self.redis_client.hgetall(self.name)
+        return {
+            task_id.decode("utf-8"): json.loads(lease)
+            for task_id, lease in leases.items()
+        }
+
+    async def find_one(self, task_id: str) -> Optional[Task]:
+        res = await self.find_one_script(
+            keys=[self.name, task_store_service.key(task_id)],
+            args=[task_id],
+        )
+        if res is None:
+            return None
+        if not res:
+            # leased before tasks were stored as hashes
+            return await task_store_service.get(task_id)
+        return task_store_service.loads_reply(res)
+
+    async def size(self):
+        return await self.redis_client.hlen(self.name)
+
+
+class RunningTaskIndex:
+    """In-process copy of the running task ids.
+
+    It follows the running hash through its pub/sub events and is
+    resynced from the hash periodically and after every reconnect. Until
+    it is in sync every id is reported as running, so callers fall back
+    to asking redis instead of dropping an event.
+    """
+
+    def __init__(
+        self,
+        running_tasks: SharedHash,
+        resync_seconds: int = settings.TASK_RUNNING_RESYNC_SECONDS,
+    ):
+        self.running_tasks = running_tasks
+        self.resync_seconds = resync_seconds
+        self.task_ids: Set[str] = set()
+        self.ready = False
+        self._listener: Optional[asyncio.Task] = None
+
+    def __contains__(self, task_id: str) -> bool:
+        return not self.ready or task_id in self.task_ids
+
+    def discard(self, task_id: str):
+        self.task_ids.discard(task_id)
+
+    async def start(self):
+        if not self._listener:
+            self._listener = asyncio.create_task(self._listen_forever())
+
+    async def close(self):
+        if self._listener:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+        self.ready = False
+
+    async def resync(self):
+        self.task_ids = await self.running_tasks.ids()
+        self.ready = True
+
+    def apply(self, data: bytes):
+        event, _, task_id = data.decode("utf-8").partition(":")
+        if event == "add":
+            self.task_ids.add(task_id)
+        elif event == "remove":
+            self.task_ids.discard(task_id)
 
-    def size(self):
-        return self.redis_client.llen(self.name)
+    async def _listen_forever(self):
+        redis_client = self.running_tasks.redis_client
+        while True:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            try:
+                # subscribe before reading the hash so nothing is missed
+                await pubsub.subscribe(self.running_tasks.events)
+                await self.resync()
+                resync_at = time.monotonic() + self.resync_seconds
+                while True:
+                    message = await pubsub.get_message(
+                        timeout=max(resync_at - time.monotonic(), 0)
+                    )
+                    if message:
+                        self.apply(message["data"])
+                    if time.monotonic() >= resync_at:
+                        await self.resync()
+                        resync_at = time.monotonic() + self.resync_seconds
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Running task index out of sync: {e}")
+                self.ready = False
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.close()
+
+
+class DispatchMetrics:
+    def __init__(self):
+        self.dispatched = 0
+        self.wait_ms_total = 0
+        self.wait_ms_max = 0
+
+    def observe(self, wait_ms: int):
+        self.dispatched += 1
+        self.wait_ms_total += wait_ms
+        self.wait_ms_max = max(self.wait_ms_max, wait_ms)
+
+    def dict(self) -> Dict:
+        return {
+            "dispatched": self.dispatched,
+            "wait_ms_avg": (
+                self.wait_ms_total // self.dispatched if self.dispatched else 0
+            ),
+            "wait_ms_max": self.wait_ms_max,
+        }
 
 
 class TaskQueueService:
+    """Shared task queue dispatched over a pool of discord accounts.
+
+    Each account has its own concurrency limit and may be cooling down
+    after a failed trigger. A task goes to the least loaded account that
+    is available, except follow-ups of a message (upscale, variation,
+    reset), which wait in the queue of the account that owns it.
+    """
+
+    # pop a task for the least loaded available account and lease it
+    DISPATCH_SCRIPT = """
+    local now = tonumber(ARGV[1])
+    local accounts = cjson.decode(ARGV[4])
+    local running = {}
+    for _, account in ipairs(accounts) do
+        running[account[1]] = 0
+    end
+    for _, raw in ipairs(redis.call("HVALS", KEYS[2])) do
+        local name = cjson.decode(raw)["account"] or accounts[1][1]
+        running[name] = (running[name] or 0) + 1
+    end
+    local free = {}
+    for i, account in ipairs(accounts) do
+        local name, limit = account[1], account[2]
+        local cooldown = tonumber(redis.call("HGET", KEYS[4], name) or 0)
+        if cooldown <= now and running[name] < limit then
+            free[#free + 1] = {i, running[name] / limit}
+        end
+    end
+    if #free == 0 then
+        return false
+    end
+    table.sort(free, function(a, b)
+        return a[2] < b[2] or (a[2] == b[2] and a[1] < b[1])
+    end)
+    -- tasks pinned to an account go before the shared queue
+    local item, index
+    for _, candidate in ipairs(free) do
+        item = redis.call("LPOP", KEYS[4 + candidate[1]])
+        if item then
+            index = candidate[1]
+            break
+        end
+    end
+    if not item then
+        item = redis.call("LPOP", KEYS[1])
+        if not item then
+            return false
+        end
+        index = free[1][1]
+    end
+    local name = accounts[index][1]
+    local task = cjson.decode(item)
+    local timeout = cjson.decode(ARGV[2])[task["callback"]] or ARGV[3]
+    local lease = {
+        action = task["callback"],
+        account = name,
+        start_time = now,
+        expire_time = now + tonumber(timeout) * 1000,
+    }
+    redis.call("HSET", KEYS[2], task["task_id"], cjson.encode(lease))
+    redis.call("PUBLISH", KEYS[3], "add:" .. task["task_id"])
+    return {item, name}
+    """
+    # these act on a message, only its own account can trigger them
+    PINNED_CALLBACKS = ("upscale", "variation", "reset")
+    MESSAGE_ACCOUNT_PREFIX = "discord-message-account:"
+    # discord rejected the account itself: bad token, banned or throttled
+    ACCOUNT_ERROR_STATUS = (401, 403, 429)
+
     def __init__(
         self,
-        concurrency_size: int = settings.TASK_QUEUE_CONCURRENCY_SIZE,
+        accounts: List[DiscordAccount] = discord_pool.accounts,
         wait_size: int = settings.TASK_QUEUE_WAIT_SIZE,
+        redis_client: async_redis.Redis = async_redis_client,
     ):
-        self.concurrency_size = concurrency_size
+        self.accounts = accounts
+        self.concurrency_size = sum(
+            account.concurrency_size for account in accounts
+        )
         self.wait_size = wait_size
 
-        self.running_tasks: SharedList = SharedList("running_tasks")
+        self.redis_client = redis_client
+        self.running_tasks: SharedHash = SharedHash("running_task_leases")
         self.waiting_tasks: SharedQueue = SharedQueue("waiting_tasks")
+        self.pinned_tasks: Dict[str, SharedQueue] = {
+            account.name: SharedQueue(f"waiting_tasks:{account.name}")
+            for account in accounts
+        }
+        # account name -> end of its cooldown in ms
+        self.account_cooldowns = "discord_account_cooldowns"
+        self.running_task_index = RunningTaskIndex(self.running_tasks)
+        self.dispatch_script = redis_client.register_script(
+            self.DISPATCH_SCRIPT
+        )
+        # pushed whenever a task is queued or a slot is freed
+        self.dispatch_signal = "waiting_tasks:signal"
+        self.dispatch_metrics = DispatchMetrics()
+        self._workers: List[asyncio.Task] = []
+        self._callbacks = set()
+
+    async def start(self):
+        if self._workers:
+            return
+        self._workers = [
+            asyncio.create_task(self._dispatch_forever()),
+            asyncio.create_task(self._reap_forever()),
+        ]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def wakeup(self):
+        """Signal the dispatchers that there may be work to start"""
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            pipe.rpush(self.dispatch_signal, 1)
+            pipe.ltrim(self.dispatch_signal, 0, self.concurrency_size)
+            await pipe.execute()
+
+    async def _dispatch_forever(self):
+        while True:
+            try:
+                # fill every free slot, then block until signalled
+                while await self.execute_task():
+                    pass
+                await self.redis_client.blpop(
+                    self.dispatch_signal,
+                    timeout=settings.TASK_QUEUE_POLL_SECONDS,
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Dispatch failed: {e}")
+                await asyncio.sleep(settings.TASK_QUEUE_POLL_SECONDS)
+
+    async def _reap_forever(self):
+        while True:
+            try:
+                await self.reap_expired_tasks()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Reap failed: {e}")
+            await asyncio.sleep(settings.TASK_REAPER_INTERVAL_SECONDS)
+
+    async def reap_expired_tasks(self) -> int:
+        """Fail running tasks whose lease expired and free their slots"""
+        now = int(round(time.time() * 1000))
+        reaped = 0
+        for task_id, lease in (await self.running_tasks.find_all()).items():
+            expire_time = lease.get("expire_time") or (
+                lease.get("start_time", now)
+                + settings.TASK_TIMEOUT_SECONDS * 1000
+            )
+            if expire_time > now:
+                continue
+            # only the worker that removes the lease fails the task
+            if not await self.running_tasks.remove(task_id):
+                continue
+            reaped += 1
+            logger.warning(f"Task {task_id} lease expired")
+            task = await task_store_service.get(task_id)
+            if not task:
+                continue
+            task.fail("timeout")
+            # refused if the bot finished the task since it was read
+            stored = await task_store_service.save(task)
+            if stored:
+                await notify_service.notify_task_change(stored)
+                await task_event_service.publish(stored)
+        if reaped:
+            await self.wakeup()
+        return reaped
 
-    def get_running_task(self, task_id: str) -> Optional[Task]:
-        return self.running_tasks.find_one(task_id)
+    async def metrics(self) -> Dict:
+        leases = await self.running_tasks.find_all()
+        waiting = await self.waiting_tasks.size()
+        cooldowns = await self.redis_client.hgetall(self.account_cooldowns)
+        accounts = {}
+        for account in self.accounts:
+            cooldown = int(cooldowns.get(account.name.encode(), 0))
+            accounts[account.name] = {
+                "running": sum(
+                    lease.get("account", self.accounts[0].name) == account.name
+                    for lease in leases.values()
+                ),
+                "pinned": await self.pinned_tasks[account.name].size(),
+                "concurrency_size": account.concurrency_size,
+                "cooldown_until": cooldown,
+            }
+            waiting += accounts[account.name]["pinned"]
+        return {
+            "running": len(leases),
+            "waiting": waiting,
+            "concurrency_size": self.concurrency_size,
+            "slot_utilisation": round(len(leases) / self.concurrency_size, 2),
+            "accounts": accounts,
+            **self.dispatch_metrics.dict(),
+        }
+
+    async def cool_down(self, account: str):
+        """Keep the account out of dispatch for a while"""
+        until = int(round(time.time() * 1000)) + (
+            settings.DISCORD_ACCOUNT_COOLDOWN_SECONDS * 1000
+        )
+        await self.redis_client.hset(self.account_cooldowns, account, until)
+
+    async def bind_message(self, msg_id: str, account: str):
+        """Remember which account owns a midjourney result message"""
+        await self.redis_client.set(
+            self.MESSAGE_ACCOUNT_PREFIX + msg_id,
+            account,
+            ex=task_store_service.timeout,
+        )
+
+    async def message_account(self, msg_id: str) -> Optional[str]:
+        account = await self.redis_client.get(
+            self.MESSAGE_ACCOUNT_PREFIX + msg_id
+        )
+        return account.decode("utf-8") if account else None
+
+    async def get_running_task(self, task_id: str) -> Optional[Task]:
+        return await self.running_tasks.find_one(task_id)
 
-    def submit_task(
+    async def submit_task(
         self,
         task: Task,
         callback: str,
         params: Dict,
     ):
-        task_store_service.save(task)
-        if self.waiting_tasks.size() >= self.wait_size:
-            raise APPException(TaskQueueBizError.QUEUE_FULL)
-        self.waiting_tasks.push(
+        await task_store_service.save(task)
+        queue = self.waiting_tasks
+        if callback in self.PINNED_CALLBACKS and params.get("msg_id"):
+            account = await self.message_account(params["msg_id"])
+            queue = self.pinned_tasks.get(account, queue)
+        pushed = await queue.push(
             {
                 "task_id": task.id,
                 "callback": callback,
                 "params": params,
-            }
+                "enqueue_time": int(round(time.time() * 1000)),
+            },
+            max_size=self.wait_size,
         )
-        self.execute_task()
+        if not pushed:
+            raise APPException(TaskQueueBizError.QUEUE_FULL)
+        await self.wakeup()
         return task
 
-    def execute_task(self):
-        if (
-            self.waiting_tasks.size()
-            and self.running_tasks.size() < self.concurrency_size
-        ):
-            item = self.waiting_tasks.pop()
-            if item:
-                task_id = item.get("task_id")
-                task = task_store_service.get(task_id)
-                self._execute(task, item)
-
-    def _execute(self, task: Task, item: Dict):
-        self.running_tasks.add(task.id)
+    async def execute_task(self) -> bool:
+        """Start the next waiting task, return False if nothing was popped"""
+        now = int(round(time.time() * 1000))
+        res = await self.dispatch_script(
+            keys=[
+                self.waiting_tasks.name,
+                self.running_tasks.name,
+                self.running_tasks.events,
+                self.account_cooldowns,
+                *[
+                    self.pinned_tasks[account.name].name
+                    for account in self.accounts
+                ],
+            ],
+            args=[
+                now,
+                json.dumps(settings.TASK_ACTION_TIMEOUT_SECONDS),
+                settings.TASK_TIMEOUT_SECONDS,
+                json.dumps(
+                    [
+                        [account.name, account.concurrency_size]
+                        for account in self.accounts
+                    ]
+                ),
+            ],
+        )
+        if not res:
+            return False
+        item, account = json.loads(res[0]), res[1].decode("utf-8")
+        task_id = item.get("task_id")
+        task = await task_store_service.get(task_id)
+        if not task:
+            logger.warning(f"Task {task_id} expired before dispatch")
+            await self.running_tasks.remove(task_id)
+            return True
+        self.dispatch_metrics.observe(now - item.get("enqueue_time", now))
+        await self._execute(task, item, account)
+        return True
+
+    async def _execute(self, task: Task, item: Dict, account: str):
         task.start()
-        task_store_service.save(task)
+        stored = await task_store_service.save(task)
+        if not stored:
+            # finished while it was waiting, there is nothing to trigger
+            await self.running_tasks.remove(task.id)
+            await self.wakeup()
+            return
+        task = stored
+        await task_event_service.publish(task)
 
-        callback = getattr(discord_service, item.get("callback"))
+        callback = getattr(discord_pool.get(account), item.get("callback"))
         if callback:
-            loop = asyncio.get_running_loop()
-            loop.create_task(callback(**item.get("params")))
+            future = asyncio.create_task(
+                self._run_callback(task, callback, item.get("params"), account)
+            )
+            self._callbacks.add(future)
+            future.add_done_callback(self._callbacks.discard)
+
+    @classmethod
+    def blames_account(cls, e: Exception) -> bool:
+        """Whether a trigger failure should rest the account"""
+        if isinstance(e, FetchStatusError):
+            return e.status in cls.ACCOUNT_ERROR_STATUS or e.status >= 500
+        # a business error is the task's fault, not the account's
+        return not isinstance(e, APPException)
+
+    async def _run_callback(
+        self, task: Task, callback, params: Dict, account: str
+    ):
+        try:
+            if not await callback(**params):
+                raise Exception("discord did not accept the trigger")
+        except Exception as e:
+            logger.warning(f"Task {task.id} trigger failed on {account}: {e}")
+            if self.blames_account(e):
+                await self.cool_down(account)
+            task.fail(str(e) or e.__class__.__name__)
+            stored = await task_store_service.save(task)
+            if stored:
+                await notify_service.notify_task_change(stored)
+                await task_event_service.publish(stored)
+            await self.running_tasks.remove(task.id)
+            await self.wakeup()
 
-    def change_status_and_notify(self, task: Task, status: TaskStatus) -> None:
+    async def change_status_and_notify(
+        self, task: Task, status: TaskStatus
+    ) -> None:
         task.set_status(status)
-        task_store_service.save(task)
-        notify_service.notify_task_change(task)
+        stored = await task_store_service.save(task)
+        if stored:
+            await notify_service.notify_task_change(stored)
+            await task_event_service.publish(stored)
 
 
 task_queue_service = TaskQueueService()
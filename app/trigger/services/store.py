@@ -1,65 +1,402 @@
 import json
+import time
+import uuid
 from abc import ABC, abstractmethod
+from hashlib import md5
+from typing import Dict, List, Optional
 
-import redis
+import redis.asyncio as async_redis
 
 from app.config import settings
-from app.trigger.schemas.task import Task
+from app.trigger.enums import TaskAction, TaskStatus
+from app.trigger.schemas.task import Task, TaskQuery
+from app.utils.redis import async_redis_client
+from app.utils.rerequest import PaginationRequest
+from app.utils.response import PaginationResponse
 
 
 class TaskStoreAbstract(ABC):
     @abstractmethod
-    def save(task: Task):
+    async def save(task: Task):
         pass
 
     @abstractmethod
-    def delete(task_id: str):
+    async def delete(task_id: str):
         pass
 
     @abstractmethod
-    def get(task_id: str):
+    async def get(task_id: str):
         pass
 
-    # @abstractmethod
-    # def find_all():
-    #     pass
+    @abstractmethod
+    async def find_all(query: TaskQuery, page: PaginationRequest):
+        pass
 
-    # @abstractmethod
-    # def find_one(condition):
-    #     pass
+    @abstractmethod
+    async def find_one(query: TaskQuery):
+        pass
 
 
 class RedisTaskStoreService(TaskStoreAbstract):
-    KEY_PREFIX = "mj-task:"
+    """Tasks stored as redis hashes, listed through sorted set indexes.
+
+    Every task is added to the ``all`` index and to one index per status,
+    action and notify hook, all scored by submit time. A query intersects
+    the indexes it filters on and reads one page of ids from the result,
+    instead of scanning the keyspace.
+    """
+
+    # tasks are hashes of their non-default fields, the old json string
+    # keys live under "mj-task:" and are rewritten as hashes when read
+    KEY_PREFIX = "mj-task-hash:"
+    LEGACY_KEY_PREFIX = "mj-task:"
+    INT_FIELDS = ("submit_time", "start_time", "finish_time")
+    JSON_FIELDS = ("properties",)
+    INDEX_PREFIX = "mj-task-index:"
+
+    # count and page a (possibly intersected) index by submit time
+    QUERY_SCRIPT = """
+    local index = KEYS[2]
+    if #KEYS > 2 then
+        local args = {"ZINTERSTORE", KEYS[1], #KEYS - 1}
+        for i = 2, #KEYS do
+            args[#args + 1] = KEYS[i]
+        end
+        args[#args + 1] = "AGGREGATE"
+        args[#args + 1] = "MAX"
+        redis.call(unpack(args))
+        index = KEYS[1]
+    end
+    local total = redis.call("ZCOUNT", index, ARGV[1], ARGV[2])
+    local ids = redis.call(
+        "ZREVRANGEBYSCORE", index, ARGV[2], ARGV[1],
+        "LIMIT", ARGV[3], ARGV[4]
+    )
+    if index == KEYS[1] then
+        redis.call("DEL", KEYS[1])
+    end
+    return {total, ids}
+    """
+
+    # raise the progress of an unfinished task in place, never lower it,
+    # and move it to the in progress index; the key ttl is kept
+    PROGRESS_SCRIPT = """
+    local fields = redis.call(
+        "HMGET", KEYS[1], "id", "status", "process", "submit_time"
+    )
+    if not fields[1] then
+        return false
+    end
+    local status = fields[2] or ARGV[3]
+    for i = 4, #ARGV do
+        if status == ARGV[i] then
+            return false
+        end
+    end
+    local progress = tonumber(ARGV[1])
+    local current = tonumber(string.match(fields[3] or "", "^(%d+)%%")) or 0
+    if progress < current or (progress == current and status == ARGV[2]) then
+        return false
+    end
+    redis.call("HSET", KEYS[1], "status", ARGV[2], "process", progress .. "%")
+    if status ~= ARGV[2] then
+        for i = 3, #KEYS do
+            redis.call("ZREM", KEYS[i], fields[1])
+        end
+        redis.call("ZADD", KEYS[2], fields[4], fields[1])
+    end
+    return redis.call("HGETALL", KEYS[1])
+    """
+
+    # write a task with its indexes unless that would leave a finished
+    # status, go back to an earlier one or lower the progress
+    SAVE_SCRIPT = """
+    local task = cjson.decode(ARGV[1])
+    local fields, stale = task["fields"], task["stale"]
+    local ranks = cjson.decode(ARGV[2])
+    local status = fields["status"] or ARGV[3]
+    local current = redis.call("HMGET", KEYS[1], "id", "status", "process")
+    if current[1] then
+        local current_status = current[2] or ARGV[3]
+        local rank, current_rank = ranks[status], ranks[current_status]
+        if current_rank == ranks[ARGV[4]] or rank < current_rank then
+            return false
+        end
+        local progress = tonumber(
+            string.match(fields["process"] or "", "^(%d+)%%")
+        ) or 0
+        local current_progress = tonumber(
+            string.match(current[3] or "", "^(%d+)%%")
+        ) or 0
+        if rank < ranks[ARGV[4]] and progress < current_progress then
+            fields["process"] = current[3]
+        end
+    end
+    local mapping = {}
+    for name, value in pairs(fields) do
+        mapping[#mapping + 1] = name
+        mapping[#mapping + 1] = value
+    end
+    redis.call("HSET", KEYS[1], unpack(mapping))
+    for _, name in ipairs(stale) do
+        if not fields[name] then
+            redis.call("HDEL", KEYS[1], name)
+        end
+    end
+    redis.call("EXPIRE", KEYS[1], ARGV[5])
+    local indexes = tonumber(ARGV[7]) + 1
+    for i = 2, indexes do
+        redis.call("ZADD", KEYS[i], fields["submit_time"], fields["id"])
+        redis.call("ZREMRANGEBYSCORE", KEYS[i], "-inf", ARGV[6])
+        redis.call("EXPIRE", KEYS[i], ARGV[5])
+    end
+    for i = indexes + 1, #KEYS do
+        redis.call("ZREM", KEYS[i], fields["id"])
+    end
+    return redis.call("HGETALL", KEYS[1])
+    """
+    # a task only moves forward, a finished one never changes again
+    STATUS_RANKS = {
+        TaskStatus.NOT_START.value: 0,
+        TaskStatus.SUBMITTED.value: 1,
+        TaskStatus.IN_PROGRESS.value: 2,
+        TaskStatus.SUCCESS.value: 3,
+        TaskStatus.FAILURE.value: 3,
+    }
 
     def __init__(
         self,
+        redis_client: async_redis.Redis,
         timeout: int = 60 * 60 * 24 * 7,
-        redis_url: str = "redis://localhost:6379/0",
     ):
         self.timeout = timeout
-        self.redis_client = redis.Redis.from_url(redis_url)
+        self.redis_client = redis_client
+        self.query_script = redis_client.register_script(self.QUERY_SCRIPT)
+        self.save_script = redis_client.register_script(self.SAVE_SCRIPT)
+        self.progress_script = redis_client.register_script(
+            self.PROGRESS_SCRIPT
+        )
+
+    def key(self, task_id: str) -> str:
+        return self.KEY_PREFIX + task_id
+
+    def index(self, name: str, value: Optional[str] = None) -> str:
+        if value is None:
+            return self.INDEX_PREFIX + name
+        return f"{self.INDEX_PREFIX}{name}:{value}"
+
+    def hook_index(self, notify_hook: str) -> str:
+        return self.index("hook", md5(notify_hook.encode()).hexdigest())
+
+    def query_indexes(self, query: TaskQuery) -> List[str]:
+        indexes = []
+        if query.status:
+            indexes.append(self.index("status", query.status))
+        if query.action:
+            indexes.append(self.index("action", query.action))
+        if query.notify_hook:
+            indexes.append(self.hook_index(query.notify_hook))
+        return indexes or [self.index("all")]
+
+    def task_indexes(self, task: Task) -> List[str]:
+        indexes = [
+            self.index("all"),
+            self.index("status", task.status),
+            self.index("action", task.action),
+        ]
+        if task.notify_hook:
+            indexes.append(self.hook_index(task.notify_hook))
+        return indexes
+
+    def dumps(self, task: Task) -> Dict[str, str]:
+        """Encode the fields that differ from their default"""
+        fields = {}
+        for name, field in Task.__fields__.items():
+            value = getattr(task, name)
+            if value is None or value == field.default:
+                continue
+            if name in self.JSON_FIELDS:
+                value = json.dumps(value, ensure_ascii=False)
+            fields[name] = str(value)
+        return fields
+
+    def loads(self, raw: Dict[bytes, bytes]) -> Task:
+        """Decode a stored task without validation, it was valid when saved"""
+        data = {name.decode(): value.decode() for name, value in raw.items()}
+        for name in self.INT_FIELDS:
+            if name in data:
+                data[name] = int(data[name])
+        for name in self.JSON_FIELDS:
+            if name in data:
+                data[name] = json.loads(data[name])
+        data["action"] = TaskAction(data["action"])
+        if "status" in data:
+            data["status"] = TaskStatus(data["status"])
+        return Task.construct(**data)
 
-    def save(self, task: Task):
-        self.redis_client.set(
-            self.KEY_PREFIX + task.id, task.json(), ex=self.timeout
+    def loads_reply(self, res: List[bytes]) -> Task:
+        """Decode a HGETALL reply returned by a script"""
+        return self.loads(dict(zip(res[::2], res[1::2])))
+
+    async def _save(self, pipe: async_redis.client.Pipeline, task: Task):
+        fields = self.dumps(task)
+        # fields back to their default are dropped
+        stale = [name for name in Task.__fields__ if name not in fields]
+        indexes = self.task_indexes(task)
+        # entries older than the task expiry point at deleted keys
+        expired = int(round(time.time() * 1000)) - self.timeout * 1000
+        await self.save_script(
+            keys=[
+                self.key(task.id),
+                *indexes,
+                *[
+                    self.index("status", status.value)
+                    for status in TaskStatus
+                    if status.value != task.status
+                ],
+            ],
+            args=[
+                json.dumps({"fields": fields, "stale": stale}),
+                json.dumps(self.STATUS_RANKS),
+                Task.__fields__["status"].default,
+                TaskStatus.SUCCESS.value,
+                self.timeout,
+                expired,
+                len(indexes),
+            ],
+            client=pipe,
         )
 
-    def delete(self, task_id: str):
-        self.redis_client.delete(self.KEY_PREFIX + task_id)
+    async def save(self, task: Task) -> Optional[Task]:
+        """Write the task, return its stored state or None if refused"""
+        return (await self.save_many([task]))[0]
+
+    async def save_many(self, tasks: List[Task]) -> List[Optional[Task]]:
+        """Write many tasks in one round-trip, see save()"""
+        # each write is atomic on its own, a refused one is not an error
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            for task in tasks:
+                await self._save(pipe, task)
+            res = await pipe.execute()
+        return [self.loads_reply(raw) if raw else None for raw in res]
+
+    async def delete(self, task_id: str):
+        task = await self.get(task_id)
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.delete(self.key(task_id))
+            if task:
+                for index in self.task_indexes(task):
+                    pipe.zrem(index, task_id)
+            await pipe.execute()
+
+    async def get(self, task_id: str):
+        res = await self.redis_client.hgetall(self.key(task_id))
+        if res:
+            return self.loads(res)
+        return (await self.migrate([task_id])).get(task_id)
+
+    async def migrate(self, task_ids: List[str]) -> Dict[str, Task]:
+        """Rewrite tasks saved as json strings into hashes, return them"""
+        legacy_keys = [
+            self.LEGACY_KEY_PREFIX + task_id for task_id in task_ids
+        ]
+        tasks = {}
+        for key, raw in zip(
+            legacy_keys, await self.redis_client.mget(legacy_keys)
+        ):
+            if raw:
+                tasks[key] = Task.parse_raw(raw)
+        if tasks:
+            async with self.redis_client.pipeline(transaction=True) as pipe:
+                for task in tasks.values():
+                    await self._save(pipe, task)
+                pipe.delete(*tasks)
+                await pipe.execute()
+        return {task.id: task for task in tasks.values()}
 
-    def get(self, task_id: str):
-        res = self.redis_client.get(self.KEY_PREFIX + task_id)
+    async def update_progress(
+        self, task_id: str, progress: int
+    ) -> Optional[Task]:
+        """Set the progress of a running task in one round-trip.
+
+        Returns the updated task, or None if the task is missing, finished
+        or already further along.
+        """
+        in_progress = TaskStatus.IN_PROGRESS.value
+        res = await self.progress_script(
+            keys=[
+                self.key(task_id),
+                self.index("status", in_progress),
+                *[
+                    self.index("status", status.value)
+                    for status in TaskStatus
+                    if status.value != in_progress
+                ],
+            ],
+            args=[
+                progress,
+                in_progress,
+                Task.__fields__["status"].default,
+                TaskStatus.SUCCESS.value,
+                TaskStatus.FAILURE.value,
+            ],
+        )
         if res:
-            data = json.loads(res)
-            return Task(**data)
+            return self.loads_reply(res)
         return None
 
-    def find_all(self):
-        pass
+    async def get_many(self, task_ids: List[str]) -> List[Optional[Task]]:
+        """Fetch many tasks in one round-trip, None for a missing task"""
+        if not task_ids:
+            return []
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            for task_id in task_ids:
+                pipe.hgetall(self.key(task_id))
+            res = await pipe.execute()
+        missing = [task_id for task_id, raw in zip(task_ids, res) if not raw]
+        migrated = await self.migrate(missing) if missing else {}
+        return [
+            self.loads(raw) if raw else migrated.get(task_id)
+            for task_id, raw in zip(task_ids, res)
+        ]
 
-    def find_one(self):
-        pass
+    async def find_all(
+        self,
+        query: TaskQuery,
+        page: PaginationRequest,
+    ) -> PaginationResponse[Task]:
+        """Page the tasks matching the query, newest first"""
+        page_number = max(page.page_number, 1)
+        page_size = max(
+            1, min(page.page_size, settings.TASK_LIST_MAX_PAGE_SIZE)
+        )
+        offset = (page_number - 1) * page_size
+        total, task_ids = await self.query_script(
+            keys=[
+                self.index("query", uuid.uuid4().hex),
+                *self.query_indexes(query),
+            ],
+            args=[
+                query.start_time if query.start_time else "-inf",
+                query.end_time if query.end_time else "+inf",
+                offset,
+                page_size,
+            ],
+        )
+        tasks = await self.get_many([task_id.decode() for task_id in task_ids])
+        return PaginationResponse[Task](
+            total=total,
+            page_number=page_number,
+            page_size=page_size,
+            rows=[task for task in tasks if task],
+        )
+
+    async def find_one(self, query: TaskQuery) -> Optional[Task]:
+        """Return the newest task matching the query"""
+        res = await self.find_all(
+            query, PaginationRequest(page_number=1, page_size=1)
+        )
+        return res.rows[0] if res.rows else None
 
 
-task_store_service = RedisTaskStoreService(redis_url=settings.REDIS_URL)
+task_store_service = RedisTaskStoreService(async_redis_client)
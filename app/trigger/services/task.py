@@ -1,9 +1,12 @@
 import time
+from typing import List
 
 from app.errors import TriggerBizError
-from app.trigger.schemas.task import Task
+from app.trigger.schemas.task import Task, TaskBatchResponse, TaskQuery
 from app.trigger.services.store import task_store_service
 from app.utils.exception import APPException
+from app.utils.rerequest import PaginationRequest
+from app.utils.response import PaginationResponse
 
 
 class TaskService:
@@ -26,14 +29,31 @@ class TaskService:
         )
 
     @classmethod
-    def details(
+    async def details(
         cls,
         task_id: str,
     ):
-        task = task_store_service.get(task_id)
+        task = await task_store_service.get(task_id)
         if not task:
             raise APPException(TriggerBizError.TASK_NOT_FOUNT)
         return task
 
+    @classmethod
+    async def find_all(
+        cls, query: TaskQuery, page: PaginationRequest
+    ) -> PaginationResponse[Task]:
+        return await task_store_service.find_all(query, page)
+
+    @classmethod
+    async def batch_details(cls, task_ids: List[str]) -> TaskBatchResponse:
+        task_ids = list(dict.fromkeys(task_ids))
+        tasks = await task_store_service.get_many(task_ids)
+        return TaskBatchResponse(
+            tasks=[task for task in tasks if task],
+            missing=[
+                task_id for task_id, task in zip(task_ids, tasks) if not task
+            ],
+        )
+
 
 task_service = TaskService()
@@ -1,17 +1,58 @@
+import asyncio
 import random
 import re
+import unicodedata
 from hashlib import md5
+from typing import Dict, List, Optional, Tuple
 
 import aiohttp
+import redis.asyncio as async_redis
 
 from app.config import settings
 from app.errors import TranslateBizError
+from app.utils.cache import LRUCache
 from app.utils.exception import APPException
-from app.utils.http import fetch
+from app.utils.http import create_session, fetch
+from app.utils.redis import async_redis_client
 
 
 class TranslateService:
     TRANSLATE_URL = "https://fanyi-api.baidu.com/api/trans/vip/translate"
+    KEY_PREFIX = "mj-translate:"
+
+    # urls, task markers, midjourney parameter flags and weights
+    PROTECTED_PATTERN = re.compile(
+        r"https?://\S+|<#\w+#>|--[A-Za-z][A-Za-z0-9-]*|::-?[\d.]*"
+    )
+    # a chinese span, it may contain full-width punctuation, digits, spaces
+    CHINESE_SPAN_PATTERN = re.compile(
+        r"[\u4e00-\u9fa5]"
+        r"(?:[\u4e00-\u9fa5\u3000-\u303f\uff00-\uffef\d\s]*[\u4e00-\u9fa5])?"
+    )
+
+    def __init__(
+        self,
+        redis_client: async_redis.Redis,
+        timeout: int = settings.TRANSLATE_CACHE_EXPIRE_SECONDS,
+        max_size: int = settings.TRANSLATE_CACHE_SIZE,
+    ):
+        self.timeout = timeout
+        self.redis_client = redis_client
+        self.local_cache = LRUCache(max_size=max_size, ttl=timeout)
+        self.stats = {
+            "local_hits": 0,
+            "shared_hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "batches": 0,
+        }
+        self.session: Optional[aiohttp.ClientSession] = None
+        # identical prompts being translated right now share one future
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # prompts waiting for the current batch window to close
+        self._batch: List[Tuple[str, asyncio.Future]] = []
+        self._batch_handle: Optional[asyncio.TimerHandle] = None
+        self._batch_tasks = set()
 
     @classmethod
     def make_md5(cls, s, encoding="utf-8"):
@@ -23,36 +64,209 @@ class TranslateService:
         return bool(pattern.search(promt))
 
     @classmethod
-    async def translate_to_en(cls, prompt: str):
-        if not cls.containsChinese(prompt):
+    def normalize(cls, prompt: str) -> str:
+        """Fold full-width characters and collapse whitespace"""
+        return " ".join(unicodedata.normalize("NFKC", prompt).split())
+
+    @classmethod
+    def split_prompt(cls, prompt: str) -> List[Tuple[str, bool]]:
+        """Split a prompt into (text, needs_translation) segments"""
+        segments = []
+        pos = 0
+        for match in cls.PROTECTED_PATTERN.finditer(prompt):
+            cls._split_text(prompt[pos : match.start()], segments)
+            segments.append((match.group(), False))
+            pos = match.end()
+        cls._split_text(prompt[pos:], segments)
+        return segments
+
+    @classmethod
+    def _split_text(cls, text: str, segments: List[Tuple[str, bool]]):
+        pos = 0
+        for match in cls.CHINESE_SPAN_PATTERN.finditer(text):
+            if match.start() > pos:
+                segments.append(
+                    (
+                        unicodedata.normalize(
+                            "NFKC", text[pos : match.start()]
+                        ),
+                        False,
+                    )
+                )
+            segments.append((match.group(), True))
+            pos = match.end()
+        if pos < len(text):
+            segments.append((unicodedata.normalize("NFKC", text[pos:]), False))
+
+    async def translate_to_en(self, prompt: str):
+        """Translate only the chinese spans and reassemble the prompt"""
+        if not self.containsChinese(prompt):
             return prompt
+        segments = self.split_prompt(prompt)
+        translations = iter(
+            await asyncio.gather(
+                *(
+                    self.translate_segment(text)
+                    for text, translate in segments
+                    if translate
+                )
+            )
+        )
         prompt_en = ""
-        async with aiohttp.ClientSession(
-            timeout=aiohttp.ClientTimeout(total=30),
-            headers={"Content-Type": "application/x-www-form-urlencoded"},
-        ) as session:
-            salt = str(random.randint(32768, 65536))
-            sign = cls.make_md5(
-                settings.BAIDU_APPID + prompt + salt + settings.BAIDU_APPKEY
+        for text, translate in segments:
+            if translate:
+                text = next(translations)
+            # keep words apart when a span was glued to latin text
+            if prompt_en[-1:].isalnum() and text[:1].isalnum():
+                prompt_en += " "
+            prompt_en += text
+        return prompt_en
+
+    async def translate_segment(self, segment: str) -> str:
+        text = self.normalize(segment)
+        key = self.make_md5(text)
+
+        prompt_en = self.local_cache.get(key)
+        if prompt_en is not None:
+            self.stats["local_hits"] += 1
+            return prompt_en
+
+        while key in self._inflight:
+            future = self._inflight[key]
+            self.stats["coalesced"] += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # only the lookup was cancelled, not us: take it over
+                if (
+                    not future.cancelled()
+                    or asyncio.current_task().cancelling()
+                ):
+                    raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            prompt_en = await self._lookup(text, key)
+            future.set_result(prompt_en)
+        except Exception as e:
+            future.set_exception(e)
+            # the error is raised here, waiters (if any) get it too
+            future.exception()
+            raise
+        finally:
+            # a cancelled lookup must not leave its waiters hanging
+            if not future.done():
+                future.cancel()
+            self._inflight.pop(key, None)
+        return prompt_en
+
+    async def _lookup(self, text: str, key: str) -> str:
+        prompt_en = await self.redis_client.get(self.KEY_PREFIX + key)
+        if prompt_en is not None:
+            self.stats["shared_hits"] += 1
+            prompt_en = prompt_en.decode("utf-8")
+        else:
+            self.stats["misses"] += 1
+            prompt_en = await self._batch_translate(text)
+            await self.redis_client.set(
+                self.KEY_PREFIX + key, prompt_en, ex=self.timeout
             )
-            payload = {
-                "appid": settings.BAIDU_APPID,
-                "q": prompt,
-                "from": "zh",
-                "to": "en",
-                "salt": salt,
-                "sign": sign,
-            }
-
-            result = await fetch(
-                session,
-                cls.TRANSLATE_URL,
-                params=payload,
+        self.local_cache.set(key, prompt_en)
+        return prompt_en
+
+    async def _batch_translate(self, text: str) -> str:
+        """Queue the text into the current batch and wait for its result"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._batch.append((text, future))
+        if (
+            len(self._batch) >= settings.TRANSLATE_BATCH_SIZE
+            or sum(len(t) for t, _ in self._batch)
+            >= settings.TRANSLATE_BATCH_MAX_CHARS
+        ):
+            self._flush_batch()
+        elif not self._batch_handle:
+            self._batch_handle = loop.call_later(
+                settings.TRANSLATE_BATCH_WINDOW_MS / 1000, self._flush_batch
+            )
+        return await future
+
+    def _flush_batch(self):
+        if self._batch_handle:
+            self._batch_handle.cancel()
+            self._batch_handle = None
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        task = asyncio.create_task(self._send_batch(batch))
+        self._batch_tasks.add(task)
+        task.add_done_callback(self._batch_tasks.discard)
+
+    async def _send_batch(self, batch: List[Tuple[str, asyncio.Future]]):
+        self.stats["batches"] += 1
+        try:
+            # baidu translates newline separated segments one by one
+            results = await self.request_translate(
+                "\n".join(text for text, _ in batch)
             )
-            if result.get("error_code"):
+            if len(results) != len(batch):
                 raise APPException(TranslateBizError.TRANSLATE_FAIL)
-            prompt_en = result["trans_result"][0]["dst"]
-        return prompt_en
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), prompt_en in zip(batch, results):
+            if not future.done():
+                future.set_result(prompt_en)
+
+    def metrics(self) -> Dict:
+        lookups = sum(
+            self.stats[name]
+            for name in ("local_hits", "shared_hits", "misses", "coalesced")
+        )
+        return {
+            **self.stats,
+            "local_cache_size": len(self.local_cache),
+            # coalesced lookups never reached the api either
+            "hit_ratio": round(1 - self.stats["misses"] / lookups, 2)
+            if lookups
+            else 0,
+        }
+
+    async def request_translate(self, prompt: str) -> List[str]:
+        if not self.session or self.session.closed:
+            self.session = create_session(
+                limit_per_host=settings.TRANSLATE_HTTP_POOL_SIZE,
+                headers={"Content-Type": "application/x-www-form-urlencoded"},
+            )
+        salt = str(random.randint(32768, 65536))
+        sign = self.make_md5(
+            settings.BAIDU_APPID + prompt + salt + settings.BAIDU_APPKEY
+        )
+        payload = {
+            "appid": settings.BAIDU_APPID,
+            "q": prompt,
+            "from": "zh",
+            "to": "en",
+            "salt": salt,
+            "sign": sign,
+        }
+
+        result = await fetch(
+            self.session,
+            self.TRANSLATE_URL,
+            params=payload,
+        )
+        if not result or result.get("error_code"):
+            raise APPException(TranslateBizError.TRANSLATE_FAIL)
+        return [item["dst"] for item in result["trans_result"]]
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+            self.session = None
 
 
-translate_service = TranslateService()
+translate_service = TranslateService(async_redis_client)
@@ -1,6 +1,9 @@
 import json
 import random
 import uuid
+from typing import Union
+
+from fastapi import UploadFile
 
 from app.errors import DiscordBizError
 from app.trigger.enums import TaskAction
@@ -13,6 +16,7 @@ from app.trigger.schemas.trigger import (
     UpscaleRequest,
     VariationRequest,
 )
+from app.trigger.services.blob import blob_store_service
 from app.trigger.services.discord import discord_service
 from app.trigger.services.midjourney import midjourney_service
 from app.trigger.services.queue import task_queue_service
@@ -34,11 +38,14 @@ class TriggerService:
     ):
         return f"{file_url + ' ' if file_url else ''}<#{task_id}#>{prompt}"
 
-    async def upload(self, file_size: int, file_type: str, image_bytes: bytes):
+    async def upload(
+        self,
+        file_size: int,
+        file_type: str,
+        image: Union[bytes, UploadFile],
+    ):
         task_id = self.generate_task_id()
-        upload_img = await discord_service.upload(
-            file_size, file_type, image_bytes
-        )
+        upload_img = await discord_service.upload(file_size, file_type, image)
         return UploadResponse(
             task_id=task_id,
             **upload_img.dict(),
@@ -58,7 +65,7 @@ class TriggerService:
             notify_hook=obj_in.notify_hook,
         )
 
-        return task_queue_service.submit_task(
+        return await task_queue_service.submit_task(
             task,
             "imagine",
             dict(prompt=task.prompt_en),
@@ -71,7 +78,7 @@ class TriggerService:
             action=TaskAction.UPSCALE.value,
         )
 
-        return task_queue_service.submit_task(
+        return await task_queue_service.submit_task(
             task,
             "upscale",
             dict(
@@ -88,7 +95,7 @@ class TriggerService:
             action=TaskAction.VARIATION.value,
         )
 
-        return task_queue_service.submit_task(
+        return await task_queue_service.submit_task(
             task,
             "variation",
             dict(
@@ -105,7 +112,7 @@ class TriggerService:
             action=TaskAction.RESET.value,
         )
 
-        return task_queue_service.submit_task(
+        return await task_queue_service.submit_task(
             task,
             "reset",
             dict(
@@ -121,13 +128,13 @@ class TriggerService:
             action=TaskAction.DESCRIBE.value,
         )
 
-        return task_queue_service.submit_task(
+        return await task_queue_service.submit_task(
             task,
             "describe",
             dict(
                 file_size=obj_in.file_size,
                 file_type=obj_in.file_type,
-                image_bytes=obj_in.image_bytes,
+                image_ref=await blob_store_service.put(obj_in.image_bytes),
             ),
         )
 
@@ -138,16 +145,16 @@ class TriggerService:
             action=TaskAction.BLEND.value,
         )
 
-        return task_queue_service.submit_task(
+        return await task_queue_service.submit_task(
             task,
             "blend",
             dict(
                 file_size=obj_in.file_size,
                 file_type=obj_in.file_type,
-                image_bytes=obj_in.image_bytes,
+                image_ref=await blob_store_service.put(obj_in.image_bytes),
                 file_size2=obj_in.file_size2,
                 file_type2=obj_in.file_type2,
-                image_bytes2=obj_in.image_bytes2,
+                image_ref2=await blob_store_service.put(obj_in.image_bytes2),
             ),
         )
 
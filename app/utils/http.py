@@ -1,8 +1,26 @@
 import asyncio
-from typing import Any, Callable, Coroutine, Dict, TypeVar, Union
+import hashlib
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Coroutine,
+    Dict,
+    TypeVar,
+    Union,
+)
 
-from aiohttp import ClientError, ClientSession, hdrs
+from aiohttp import (
+    ClientError,
+    ClientSession,
+    ClientTimeout,
+    TCPConnector,
+    hdrs,
+)
+from fastapi import UploadFile
 
+from app.errors import TriggerBizError
+from app.utils.exception import APPException
 from app.utils.logger import setup_logger
 
 T = TypeVar("T")
@@ -38,24 +56,99 @@ class MaxRetry:
         return connect_n_times
 
 
+class FetchStatusError(Exception):
+    """A response with a non-2xx status, raised only when asked for"""
+
+    def __init__(self, url: str, status: int):
+        super().__init__(f"{url} responded with status {status}")
+        self.url = url
+        self.status = status
+
+
 class FetchMethod:
     get = hdrs.METH_GET
     post = hdrs.METH_POST
     put = hdrs.METH_PUT
 
 
+class UploadStream:
+    """Request body that streams an uploaded file in bounded chunks.
+
+    Each iteration restarts from the beginning of the file, so the body
+    can be sent again when the request is retried.
+    """
+
+    def __init__(
+        self,
+        file: UploadFile,
+        chunk_size: int = 64 * 1024,
+        max_size: int = 0,
+    ):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.max_size = max_size
+
+    def __aiter__(self) -> AsyncIterator[bytes]:
+        return self._read()
+
+    async def _read(self) -> AsyncIterator[bytes]:
+        await self.file.seek(0)
+        size = 0
+        while chunk := await self.file.read(self.chunk_size):
+            size += len(chunk)
+            if self.max_size and size > self.max_size:
+                raise APPException(TriggerBizError.FILE_TOO_LARGE)
+            yield chunk
+
+    async def sha256(self) -> str:
+        digest = hashlib.sha256()
+        async for chunk in self:
+            digest.update(chunk)
+        return digest.hexdigest()
+
+
+def create_session(
+    limit: int = 100,
+    limit_per_host: int = 0,
+    keepalive_timeout: float = 15,
+    ttl_dns_cache: int = 10,
+    timeout: float = 30,
+    headers: Dict[str, Any] = None,
+) -> ClientSession:
+    """Create a long-lived session backed by a pooled connector.
+
+    The session is meant to be reused for the lifetime of the app so that
+    TCP and TLS connections are kept alive between requests.
+    """
+    connector = TCPConnector(
+        limit=limit,
+        limit_per_host=limit_per_host,
+        keepalive_timeout=keepalive_timeout,
+        ttl_dns_cache=ttl_dns_cache,
+    )
+    return ClientSession(
+        connector=connector,
+        timeout=ClientTimeout(total=timeout),
+        headers=headers,
+    )
+
+
 @MaxRetry(2)
 async def fetch(
     session: ClientSession,
     url: str,
     method: str = FetchMethod.post,
     is_json: bool = True,
+    raise_for_status: bool = False,
     **kwargs,
 ) -> Union[bool, None]:
     logger.debug(f"Fetch: {url}, {kwargs}")
     async with session.request(method, url, **kwargs) as resp:
         print("resp.ok->", resp.ok)
         if not resp.ok:
+            # not a ClientError, a rejected request is not retried
+            if raise_for_status:
+                raise FetchStatusError(url, resp.status)
             return None
         if is_json:
             return await resp.json()
@@ -1,4 +1,5 @@
 import redis
+import redis.asyncio as async_redis
 
 from app.config import settings
 
@@ -7,4 +8,18 @@ def setup_redis():
     return redis.Redis(settings.REDIS_HOST, settings.REDIS_PORT)
 
 
+def setup_async_redis(
+    redis_url: str = settings.REDIS_URL,
+    max_connections: int = settings.REDIS_POOL_SIZE,
+    timeout: int = settings.REDIS_POOL_TIMEOUT_SECONDS,
+) -> async_redis.Redis:
+    # callers wait for a free connection instead of failing at the cap
+    pool = async_redis.BlockingConnectionPool.from_url(
+        redis_url, max_connections=max_connections, timeout=timeout
+    )
+    return async_redis.Redis(connection_pool=pool)
+
+
 redis_client = setup_redis()
+# shared by the task queue and the task store
+async_redis_client = setup_async_redis()
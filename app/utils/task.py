@@ -1,7 +1,132 @@
-from typing import Dict, List, Tuple
+import asyncio
+import json
+from typing import Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.trigger.enums import TaskStatus
+from app.trigger.schemas.task import Task
+from app.trigger.services.event import task_event_service
+from app.trigger.services.notify import notify_service
+from app.trigger.services.store import task_store_service
+from app.utils.logger import setup_logger
+
+logger = setup_logger("TaskStatus")
+
+FINISHED_STATUS = (TaskStatus.SUCCESS.value, TaskStatus.FAILURE.value)
 
 
 async def batch_update_task_status(
-    events: List[Tuple[str, Dict]]
+    events: List[Tuple[str, Dict]],
 ) -> List[str]:
-    ...
+    """Persist and notify task transitions, return the handled event ids
+
+    Each event is ``(event_id, {"payload": task_json})``, the shape a
+    RedisStream consumer receives. Only the latest transition of a task is
+    written, the store refuses one that would move a task back, and only
+    the stored state of the accepted ones is announced.
+    """
+    handled: List[str] = []
+    latest: Dict[str, Task] = {}
+    event_ids: List[str] = []
+    for event_id, fields in events:
+        try:
+            task = Task(**json.loads(fields["payload"]))
+        except (KeyError, TypeError, ValueError) as e:
+            # a malformed event will never succeed, drop it
+            logger.warning(f"Drop task event {event_id}: {e}")
+            handled.append(event_id)
+            continue
+        event_ids.append(event_id)
+        previous = latest.get(task.id)
+        if (
+            previous
+            and previous.status in FINISHED_STATUS
+            and task.status not in FINISHED_STATUS
+        ):
+            continue
+        latest[task.id] = task
+
+    if not latest:
+        return handled
+    tasks = list(latest.values())
+    try:
+        stored = await task_store_service.save_many(tasks)
+    except Exception as e:
+        logger.warning(f"Failed to save {len(tasks)} tasks: {e}")
+        return handled
+
+    # a refused write is handled too, retrying it would never succeed
+    accepted = [task for task in stored if task]
+    if accepted:
+        await announce_task_changes(accepted)
+    return handled + event_ids
+
+
+async def announce_task_changes(tasks: List[Task]):
+    """Publish already saved tasks to watchers and webhooks"""
+    published, *notified = await asyncio.gather(
+        task_event_service.publish(*tasks),
+        *[notify_service.notify_task_change(task) for task in tasks],
+        return_exceptions=True,
+    )
+    if isinstance(published, Exception):
+        logger.warning(f"Failed to publish task events: {published}")
+    for task, result in zip(tasks, notified):
+        if isinstance(result, Exception):
+            logger.warning(f"Failed to notify task {task.id}: {result}")
+
+
+class TaskStatusPipeline:
+    """Buffers status transitions and writes each burst in one round-trip"""
+
+    RETRY_DELAY_SECONDS = 1
+
+    def __init__(
+        self,
+        window_ms: int = settings.TASK_STATUS_BATCH_WINDOW_MS,
+        batch_size: int = settings.TASK_STATUS_BATCH_SIZE,
+    ):
+        self.window_ms = window_ms
+        self.batch_size = batch_size
+        self._events: List[Tuple[str, Dict]] = []
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._flushes = set()
+
+    def submit(self, task: Task):
+        self._events.append((task.id, {"payload": task.json()}))
+        if len(self._events) >= self.batch_size:
+            self.flush()
+        else:
+            self._schedule(self.window_ms / 1000)
+
+    def _schedule(self, delay: float):
+        if not self._handle:
+            self._handle = asyncio.get_running_loop().call_later(
+                delay, self.flush
+            )
+
+    def flush(self):
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+        events, self._events = self._events, []
+        if not events:
+            return
+        flush = asyncio.create_task(self._write(events))
+        self._flushes.add(flush)
+        flush.add_done_callback(self._flushes.discard)
+
+    async def _write(self, events: List[Tuple[str, Dict]]):
+        handled = set(await batch_update_task_status(events))
+        failed = [event for event in events if event[0] not in handled]
+        if failed:
+            # retry shortly, newer transitions of a task still win
+            self._events = failed + self._events
+            self._schedule(self.RETRY_DELAY_SECONDS)
+
+    async def close(self):
+        self.flush()
+        await asyncio.gather(*self._flushes, return_exceptions=True)
+
+
+task_status_pipeline = TaskStatusPipeline()
@@ -0,0 +1,120 @@
+"""Banned word matching over a prompt corpus, substring loop vs regex.
+
+The corpus is one prompt per line from --prompts, or generated prompts
+in the shape of midjourney requests with a few banned words mixed in.
+
+    python benchmarks/bench_banned_words.py --prompts prompts.txt
+"""
+
+import argparse
+import random
+import re
+import time
+from typing import List
+
+from common import report
+
+from app.trigger.services.midjourney import MidjourneyService
+
+SUBJECTS = [
+    "a portrait of an old fisherman",
+    "a cyberpunk city street at night",
+    "a cozy cabin in a snowy forest",
+    "an astronaut riding a horse",
+    "a bowl of ramen, studio lighting",
+    "a lighthouse on a cliff during a storm",
+    "a scarlet macaw in the rainforest",
+    "a watercolor map of an island",
+    "a glass vase on a classic oak table",
+]
+STYLES = [
+    "cinematic, 35mm, shallow depth of field",
+    "in the style of studio ghibli",
+    "octane render, volumetric light, 8k",
+    "oil painting, impasto, warm palette",
+    "isometric, low poly, pastel colors",
+]
+FLAGS = ["--ar 16:9", "--v 5.2", "--q 2", "--stylize 750", "--chaos 20"]
+
+
+def generate_prompts(count: int, banned: List[str]) -> List[str]:
+    rng = random.Random(42)
+    prompts = []
+    for i in range(count):
+        parts = [rng.choice(SUBJECTS), rng.choice(STYLES)]
+        if i % 20 == 0:
+            parts.insert(1, rng.choice(banned))
+        prompts.append(", ".join(parts) + " " + rng.choice(FLAGS))
+    return prompts
+
+
+def substring_loop(words: List[str], prompt: str) -> bool:
+    """is_banned before the compiled pattern"""
+    prompt = prompt.lower()
+    for word in words:
+        if word in prompt:
+            return True
+    return False
+
+
+def flat_alternation(words: List[str]) -> re.Pattern:
+    """One branch per word, the first compiled version"""
+    alternatives = []
+    for word in sorted(set(words), key=len, reverse=True):
+        lead = r"(?<![a-z0-9])" if word[0].isalnum() else ""
+        trail = r"(?![a-z0-9])" if word[-1].isalnum() else ""
+        alternatives.append(lead + re.escape(word) + trail)
+    return re.compile("|".join(alternatives), re.IGNORECASE)
+
+
+def measure(name: str, check, prompts: List[str], rounds: int) -> int:
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        banned = sum(1 for prompt in prompts if check(prompt))
+        samples.append((time.perf_counter() - start) / len(prompts))
+    report(name, samples, unit="us")
+    return banned
+
+
+def main(args):
+    service = MidjourneyService()
+    words = service.banned_words
+    if args.prompts:
+        with open(args.prompts) as f:
+            prompts = [line.strip() for line in f if line.strip()]
+    else:
+        prompts = generate_prompts(args.count, words)
+
+    start = time.perf_counter()
+    MidjourneyService.compile_banned_words(words)
+    print(
+        f"{len(words)} banned words, {len(prompts)} prompts, pattern built"
+        f" in {(time.perf_counter() - start) * 1e3:.1f}ms"
+    )
+    looped = measure(
+        "substring loop",
+        lambda prompt: substring_loop(words, prompt),
+        prompts,
+        args.rounds,
+    )
+    flat = flat_alternation(words)
+    measure(
+        "flat alternation",
+        lambda prompt: bool(flat.search(prompt)),
+        prompts,
+        args.rounds,
+    )
+    compiled = measure(
+        "prefix tree pattern", service.is_banned, prompts, args.rounds
+    )
+    # substrings also hit inside longer words, e.g. "ass" in "glass"
+    print(f"banned prompts: substring loop {looped}, whole words {compiled}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--prompts", help="file with one prompt per line")
+    parser.add_argument("--count", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=5)
+    main(parser.parse_args())
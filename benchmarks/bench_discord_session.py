@@ -0,0 +1,75 @@
+"""Per-call latency of discord requests, pooled session vs one per call.
+
+A local stub stands in for the interactions endpoint, so the numbers
+only show the connection setup saved by the pooled session; against
+discord.com every new session also pays a TLS handshake.
+
+    python benchmarks/bench_discord_session.py --calls 500 --concurrency 10
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from aiohttp import web
+from common import report, start_stub
+
+from app.config import settings
+from app.trigger.services.discord import DiscordService
+
+
+async def interactions(request: web.Request) -> web.Response:
+    await request.read()
+    return web.Response(status=204)
+
+
+async def measure(
+    service: DiscordService, url: str, calls: int, concurrency: int
+):
+    samples = []
+    semaphore = asyncio.Semaphore(concurrency)
+    payload = json.dumps(service.payload(type=2, nonce="1").dict())
+
+    async def call():
+        async with semaphore:
+            start = time.perf_counter()
+            await service.request(url=url, data=payload, is_json=False)
+            samples.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(call() for _ in range(calls)))
+    return samples, time.perf_counter() - start
+
+
+async def main(args):
+    runner, base_url = await start_stub(
+        [("POST", "/api/v9/interactions", interactions)]
+    )
+    url = base_url + "/api/v9/interactions"
+    service = DiscordService(settings.DISCORD_ACCOUNTS[0])
+    try:
+        # without setup() every request opens and closes its own session
+        samples, elapsed = await measure(
+            service, url, args.calls, args.concurrency
+        )
+        report("session per call", samples)
+        print(f"{'':<32} {args.calls / elapsed:.0f} req/s")
+
+        await service.setup()
+        await measure(service, url, args.concurrency, args.concurrency)
+        samples, elapsed = await measure(
+            service, url, args.calls, args.concurrency
+        )
+        report("pooled session", samples)
+        print(f"{'':<32} {args.calls / elapsed:.0f} req/s")
+    finally:
+        await service.close()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=10)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,93 @@
+"""Bot message parsing, the old per-call regexes vs MessageParser.
+
+Messages come from --samples, a file with one json encoded message
+content per line, or from a built-in mix in which most messages are not
+ours, like the bot channel.
+
+    python benchmarks/bench_message_parser.py --samples messages.jsonl
+"""
+
+import argparse
+import json
+import random
+import re
+import time
+from typing import List, Optional, Tuple
+
+from common import report
+
+from app.trigger.services.parser import message_parser
+
+OURS = [
+    "**<#{id}#> a lighthouse on a cliff --ar 16:9** - <@1024> (31%) (fast)",
+    "**<#{id}#> a lighthouse on a cliff** - <@1024> (Waiting to start)",
+    "**<#{id}#> a cat (50%) in a box** - Variations (Strong) by <@1024>"
+    " (12%) (fast)",
+    "**<#{id}#> ramen, studio lighting** - Remix (Subtle) by <@1024> (46%)",
+    "**<#{id}#> ramen, studio lighting** - <@1024> (fast)",
+    "**<#{id}#> ramen, studio lighting** - Image #2 <@1024>",
+]
+FOREIGN = [
+    "**an astronaut riding a horse --v 5.2** - <@2048> (fast)",
+    "**an astronaut riding a horse** - <@2048> (78%) (relaxed)",
+    "**isometric city, pastel colors** - Variations by <@4096> (fast)",
+    "good morning everyone",
+    "https://cdn.discordapp.com/attachments/1/2/grid_0.png",
+]
+FILENAME = "user_a_lighthouse_on_a_cliff_6f1d2c3b-aa.png"
+
+
+def recorded_mix(count: int) -> List[str]:
+    rng = random.Random(7)
+    messages = []
+    for i in range(count):
+        # about one message in five belongs to this service
+        if i % 5 == 0:
+            messages.append(rng.choice(OURS).format(id=f"{i:019d}"))
+        else:
+            messages.append(rng.choice(FOREIGN))
+    return messages
+
+
+def old_parse(content: str, filename: Optional[str]) -> Tuple:
+    """on_message and on_message_edit before MessageParser"""
+    task_id = re.findall(r"<#(\w+?)#>", content)
+    task_id = task_id[0] if task_id else None
+    if not task_id:
+        return None
+    match = re.search(r"<#(.*?)#>.*?\((\d+)%\)", content)
+    progress = match.group(2) if match else None
+    waiting = "Waiting to start" in content
+    msg_hash = filename.split("_")[-1].split(".")[0] if filename else ""
+    return task_id, progress, waiting, msg_hash
+
+
+def measure(name: str, parse, messages: List[str], rounds: int) -> int:
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for content in messages:
+            parse(content, FILENAME)
+        samples.append((time.perf_counter() - start) / len(messages))
+    report(name, samples, unit="us")
+    return sum(1 for content in messages if parse(content, FILENAME))
+
+
+def main(args):
+    if args.samples:
+        with open(args.samples) as f:
+            messages = [json.loads(line) for line in f if line.strip()]
+    else:
+        messages = recorded_mix(args.count)
+    print(f"{len(messages)} messages")
+    old = measure("per-call regexes", old_parse, messages, args.rounds)
+    new = measure("MessageParser", message_parser.parse, messages, args.rounds)
+    print(f"messages of ours: per-call regexes {old}, MessageParser {new}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--samples", help="file with one json message a line")
+    parser.add_argument("--count", type=int, default=10000)
+    parser.add_argument("--rounds", type=int, default=20)
+    main(parser.parse_args())
@@ -0,0 +1,101 @@
+"""Webhook latency of a fast endpoint while another endpoint is slow.
+
+Two local stubs play two customers: one answers at once, the other
+sleeps before answering. Both get the same number of notifications at
+the same time, through the old 5-thread ``requests.post`` pool and
+through ``NotifyService.deliver`` with its per-host sessions and limits.
+
+    python benchmarks/bench_notify_isolation.py --slow-seconds 2
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from aiohttp import web
+from common import report, start_stub
+
+from app.trigger.services.notify import NotifyService
+from app.utils.redis import async_redis_client
+
+BODY = json.dumps({"id": "1", "status": "success"})
+
+
+def slow_endpoint(delay: float):
+    async def handle(request: web.Request) -> web.Response:
+        await request.read()
+        await asyncio.sleep(delay)
+        return web.Response()
+
+    return handle
+
+
+async def fast_endpoint(request: web.Request) -> web.Response:
+    await request.read()
+    return web.Response()
+
+
+async def timed(coro) -> float:
+    start = time.perf_counter()
+    await coro
+    return time.perf_counter() - start
+
+
+async def run_thread_pool(slow_url: str, fast_url: str, count: int):
+    """NotifyService before the async engine"""
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=5) as pool:
+
+        def post(url: str):
+            return loop.run_in_executor(pool, requests.post, url, BODY)
+
+        slow = [timed(post(slow_url)) for _ in range(count)]
+        fast = [timed(post(fast_url)) for _ in range(count)]
+        results = await asyncio.gather(*slow, *fast)
+    return results[:count], results[count:]
+
+
+async def run_notify_service(
+    slow_url: str, fast_url: str, count: int, slow_seconds: float
+):
+    service = NotifyService(async_redis_client, timeout=slow_seconds + 10)
+    try:
+        slow = [timed(service.deliver(slow_url, BODY)) for _ in range(count)]
+        fast = [timed(service.deliver(fast_url, BODY)) for _ in range(count)]
+        results = await asyncio.gather(*slow, *fast)
+    finally:
+        await service.close()
+    return results[:count], results[count:]
+
+
+async def main(args):
+    slow_runner, slow_url = await start_stub(
+        [("POST", "/hook", slow_endpoint(args.slow_seconds))]
+    )
+    fast_runner, fast_url = await start_stub(
+        [("POST", "/hook", fast_endpoint)]
+    )
+    slow_url += "/hook"
+    fast_url += "/hook"
+    try:
+        slow, fast = await run_thread_pool(slow_url, fast_url, args.count)
+        report("thread pool: slow endpoint", slow)
+        report("thread pool: fast endpoint", fast)
+        slow, fast = await run_notify_service(
+            slow_url, fast_url, args.count, args.slow_seconds
+        )
+        report("notify service: slow endpoint", slow)
+        report("notify service: fast endpoint", fast)
+    finally:
+        await slow_runner.cleanup()
+        await fast_runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=20)
+    parser.add_argument("--slow-seconds", type=float, default=2)
+    asyncio.run(main(parser.parse_args()))
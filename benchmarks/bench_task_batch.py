@@ -0,0 +1,81 @@
+"""Looking up many tasks, one call per task vs one batch call.
+
+Saves --tasks tasks under throwaway ids in the redis at REDIS_URL, reads
+them back one by one (the way a dashboard polled GET /task/{id}),
+concurrently, and with the get_many call behind POST /task/batch, then
+deletes them.
+
+    REDIS_URL=redis://127.0.0.1:6379/15 python benchmarks/bench_task_batch.py
+"""
+
+import argparse
+import asyncio
+import time
+import uuid
+
+from common import report
+
+from app.trigger.enums import TaskAction, TaskStatus
+from app.trigger.schemas.task import Task
+from app.trigger.services.store import task_store_service
+
+
+def make_tasks(count: int):
+    prefix = f"bench-{uuid.uuid4().hex[:8]}-"
+    now = int(time.time() * 1000)
+    return [
+        Task(
+            id=f"{prefix}{i}",
+            action=TaskAction.IMAGINE.value,
+            status=TaskStatus.IN_PROGRESS.value,
+            prompt=f"a lighthouse on a cliff, number {i} --ar 16:9",
+            prompt_en=f"a lighthouse on a cliff, number {i} --ar 16:9",
+            submit_time=now + i,
+            start_time=now + i,
+            process="42%",
+        )
+        for i in range(count)
+    ]
+
+
+async def timed(coro):
+    start = time.perf_counter()
+    result = await coro
+    return time.perf_counter() - start, result
+
+
+async def one_by_one(task_ids):
+    return [await task_store_service.get(task_id) for task_id in task_ids]
+
+
+async def main(args):
+    tasks = make_tasks(args.tasks)
+    task_ids = [task.id for task in tasks]
+    await task_store_service.save_many(tasks)
+    try:
+        sequential, concurrent, batched = [], [], []
+        for _ in range(args.rounds):
+            elapsed, found = await timed(one_by_one(task_ids))
+            assert all(found)
+            sequential.append(elapsed)
+            elapsed, found = await timed(
+                asyncio.gather(*map(task_store_service.get, task_ids))
+            )
+            assert all(found)
+            concurrent.append(elapsed)
+            elapsed, found = await timed(task_store_service.get_many(task_ids))
+            assert all(found)
+            batched.append(elapsed)
+        report(f"{args.tasks} single lookups", sequential)
+        report(f"{args.tasks} concurrent lookups", concurrent)
+        report("one batch lookup", batched)
+    finally:
+        for task_id in task_ids:
+            await task_store_service.delete(task_id)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tasks", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=10)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,156 @@
+"""Task storage, the old json string keys vs the hash encoding.
+
+Reports the bytes stored per task, the decode cost of each format and
+the save/get throughput against the redis at REDIS_URL, with and
+without the list indexes save() also maintains. Throwaway
+tasks are deleted afterwards.
+
+    REDIS_URL=redis://127.0.0.1:6379/15 python benchmarks/bench_task_store.py
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from typing import List
+
+from common import report
+
+from app.trigger.enums import TaskAction, TaskStatus
+from app.trigger.schemas.task import Task
+from app.trigger.services.store import task_store_service
+from app.utils.redis import async_redis_client
+
+JSON_PREFIX = "bench-task-json:"
+
+
+def make_tasks(count: int) -> List[Task]:
+    prefix = uuid.uuid4().hex[:8]
+    now = int(time.time() * 1000)
+    return [
+        Task(
+            id=f"{prefix}{i}",
+            action=TaskAction.UPSCALE.value,
+            status=TaskStatus.IN_PROGRESS.value,
+            prompt="一座海边的灯塔, cinematic lighting --ar 16:9",
+            prompt_en="a lighthouse by the sea, cinematic lighting --ar 16:9",
+            notify_hook="https://example.com/hooks/midjourney",
+            submit_time=now + i,
+            start_time=now + i,
+            process="42%",
+            properties={"msg_id": "1130000000000000000", "index": 2},
+        )
+        for i in range(count)
+    ]
+
+
+async def memory_usage(key: str):
+    try:
+        return await async_redis_client.memory_usage(key)
+    except Exception:
+        # not every redis compatible server has MEMORY USAGE
+        return None
+
+
+async def compare_size(task: Task):
+    json_key = JSON_PREFIX + task.id
+    await async_redis_client.set(json_key, task.json())
+    await task_store_service.save(task)
+    payload = {
+        "json": len(task.json().encode()),
+        "hash": sum(
+            len(name) + len(value.encode())
+            for name, value in task_store_service.dumps(task).items()
+        ),
+    }
+    memory = {
+        "json": await memory_usage(json_key),
+        "hash": await memory_usage(task_store_service.key(task.id)),
+    }
+    for name in ("json", "hash"):
+        used = memory[name]
+        print(
+            f"{name:<5} payload={payload[name]:5d}B"
+            + (f" redis memory={used:5d}B" if used else "")
+        )
+
+
+def compare_decode(task: Task, rounds: int):
+    raw_json = task.json()
+    raw_hash = {
+        name.encode(): value.encode()
+        for name, value in task_store_service.dumps(task).items()
+    }
+    for name, decode in [
+        ("json + validation", lambda: Task(**json.loads(raw_json))),
+        ("hash, no validation", lambda: task_store_service.loads(raw_hash)),
+    ]:
+        samples = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            decode()
+            samples.append(time.perf_counter() - start)
+        report(f"decode {name}", samples, unit="us")
+
+
+async def compare_throughput(tasks: List[Task]):
+    async def json_save(task: Task):
+        await async_redis_client.set(
+            JSON_PREFIX + task.id, task.json(), ex=task_store_service.timeout
+        )
+
+    async def json_get(task: Task):
+        return Task(
+            **json.loads(await async_redis_client.get(JSON_PREFIX + task.id))
+        )
+
+    async def hash_save(task: Task):
+        # the encoding alone, without the list indexes written by save()
+        key = task_store_service.key(task.id)
+        async with async_redis_client.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping=task_store_service.dumps(task))
+            pipe.expire(key, task_store_service.timeout)
+            await pipe.execute()
+
+    async def hash_get(task: Task):
+        return await task_store_service.get(task.id)
+
+    for name, save, get in [
+        ("json", json_save, json_get),
+        ("hash", hash_save, hash_get),
+        ("hash + indexes", task_store_service.save, hash_get),
+    ]:
+        start = time.perf_counter()
+        for task in tasks:
+            await save(task)
+        saved = time.perf_counter() - start
+        start = time.perf_counter()
+        for task in tasks:
+            await get(task)
+        loaded = time.perf_counter() - start
+        print(
+            f"{name:<14} save={len(tasks) / saved:8.0f}/s"
+            f" get={len(tasks) / loaded:8.0f}/s"
+        )
+
+
+async def main(args):
+    tasks = make_tasks(args.tasks)
+    try:
+        await compare_size(tasks[0])
+        compare_decode(tasks[0], args.rounds)
+        await compare_throughput(tasks)
+    finally:
+        await async_redis_client.delete(
+            *[JSON_PREFIX + task.id for task in tasks]
+        )
+        for task in tasks:
+            await task_store_service.delete(task.id)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tasks", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=10000)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,111 @@
+"""Peak RSS of concurrent uploads, read into memory vs streamed.
+
+Every mode runs in a fresh process, since the peak RSS of a process
+never goes down. The uploads are PUT to a local stub that discards the
+body, the way /trigger/upload sends a file to the presigned url.
+
+    python benchmarks/bench_upload_memory.py --uploads 8 --size-mb 20
+"""
+
+import argparse
+import asyncio
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from aiohttp import web
+from common import start_stub
+from fastapi import UploadFile
+
+from app.config import settings
+from app.trigger.services.discord import DiscordService
+
+MODES = ("read", "stream")
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def discard(request: web.Request) -> web.Response:
+    async for _ in request.content.iter_chunked(64 * 1024):
+        pass
+    return web.Response()
+
+
+async def upload(
+    service: DiscordService, url: str, path: str, mode: str, size: int
+):
+    with open(path, "rb") as f:
+        image = UploadFile(f, size=size, filename=os.path.basename(path))
+        if mode == "read":
+            await service.put_attachment(url, await image.read())
+        else:
+            await service.put_attachment(url, image, size)
+
+
+async def run(args):
+    runner, base_url = await start_stub([("PUT", "/upload", discard)])
+    service = DiscordService(settings.DISCORD_ACCOUNTS[0])
+    await service.setup()
+    size = os.path.getsize(args.file)
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(
+            *(
+                upload(
+                    service, base_url + "/upload", args.file, args.mode, size
+                )
+                for _ in range(args.uploads)
+            )
+        )
+    finally:
+        await service.close()
+        await runner.cleanup()
+    elapsed = time.perf_counter() - start
+    peak = peak_rss_mb()
+    print(
+        f"{args.mode:<8} uploads={args.uploads} size={size >> 20}MB"
+        f" peak_rss={peak:7.1f}MB (+{peak - baseline:6.1f}MB)"
+        f" elapsed={elapsed:.2f}s"
+    )
+
+
+def main(args):
+    with tempfile.NamedTemporaryFile(suffix=".png") as f:
+        # random bytes, the same file is uploaded by every request
+        for _ in range(args.size_mb):
+            f.write(os.urandom(1 << 20))
+        f.flush()
+        for mode in MODES:
+            subprocess.run(
+                [
+                    sys.executable,
+                    __file__,
+                    "--mode",
+                    mode,
+                    "--file",
+                    f.name,
+                    "--uploads",
+                    str(args.uploads),
+                ],
+                check=True,
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--uploads", type=int, default=8)
+    parser.add_argument("--size-mb", type=int, default=20)
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.mode:
+        asyncio.run(run(args))
+    else:
+        main(args)
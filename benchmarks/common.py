@@ -0,0 +1,71 @@
+"""Shared setup for the benchmark scripts.
+
+Run a script from the repository root, e.g.
+``python benchmarks/bench_discord_session.py``. app.config needs a full
+environment, variables that are not set get placeholder values; nothing
+but the local stubs (and REDIS_URL for the redis benchmarks) is contacted.
+"""
+
+import os
+import statistics
+import sys
+from typing import Awaitable, Callable, List, Tuple
+
+from aiohttp import web
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PLACEHOLDER_ENV = {
+    "PROJECT_NAME": "midjourney-api",
+    "SERVER_HOST": "127.0.0.1",
+    "SERVER_PORT": "9999",
+    "DATABASE_URL": "sqlite://:memory:",
+    "REDIS_BROKER": "redis://127.0.0.1:6379/0",
+    "REDIS_BACKEND": "redis://127.0.0.1:6379/0",
+    "REDIS_TESTING": "true",
+    "REDIS_URL": "redis://127.0.0.1:6379/15",
+    "REDIS_HOST": "127.0.0.1",
+    "REDIS_PORT": "6379",
+    "DISCORD_USER_TOKEN": "user-token",
+    "DISCORD_BOT_TOKEN": "bot-token",
+    "DISCORD_GUILD_ID": "1",
+    "DISCORD_CHANNEL_ID": "1",
+    "DISCORD_APPLICATION_ID": "1",
+    "DISCORD_SESSION_ID": "session",
+    "NOTIFY_HOOK": "http://127.0.0.1:9000/notify",
+    "BAIDU_APPID": "appid",
+    "BAIDU_APPKEY": "appkey",
+}
+for key, value in PLACEHOLDER_ENV.items():
+    os.environ.setdefault(key, value)
+
+Handler = Callable[[web.Request], Awaitable[web.StreamResponse]]
+
+
+async def start_stub(
+    routes: List[Tuple[str, str, Handler]],
+) -> Tuple[web.AppRunner, str]:
+    """Serve ``(method, path, handler)`` routes on a free local port"""
+    app = web.Application(client_max_size=0)
+    for method, path, handler in routes:
+        app.router.add_route(method, path, handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+def report(name: str, samples: List[float], unit: str = "ms"):
+    """Print the mean and percentiles of samples given in seconds"""
+    scale = {"ms": 1e3, "us": 1e6}[unit]
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(
+        f"{name:<32} n={len(samples):<6}"
+        f" mean={statistics.mean(samples) * scale:9.3f}{unit}"
+        f" p50={statistics.median(samples) * scale:9.3f}{unit}"
+        f" p95={p95 * scale:9.3f}{unit}"
+    )
@@ -1,4 +1,3 @@
-import re
 from enum import Enum
 from typing import Dict, Optional
 
@@ -8,91 +7,109 @@ from discord.ext import commands
 from app.config import settings
 from app.trigger.enums import TaskStatus
 from app.trigger.schemas.task import Task
+from app.trigger.services.parser import message_parser
 from app.trigger.services.queue import task_queue_service
 from app.trigger.services.store import task_store_service
+from app.utils.task import announce_task_changes, task_status_pipeline
 
 intents = discord.Intents.default()
 intents.message_content = True
 bot = commands.Bot(command_prefix="", intents=intents)
 
 
-def extract_trigger_id(content):
-    pattern = r"<#(\w+?)#>"
-    match = re.findall(pattern, content)
-    return match[0] if match else None
+class DiscordBotClient(discord.Client):
+    """Listens on the channels of every configured account"""
 
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.channel_accounts = {
+            account.channel_id: account.name
+            for account in settings.DISCORD_ACCOUNTS
+        }
 
-class DiscordBotClient(discord.Client):
     async def on_ready(self):
         print(f"Logged in as {self.user} (ID: {self.user.id})")
 
+    async def setup_hook(self):
+        await task_queue_service.running_task_index.start()
+
+    async def close(self):
+        await task_status_pipeline.close()
+        await task_queue_service.running_task_index.close()
+        await super().close()
+
     async def handle(
         self, task: Task, properties: Optional[Dict], task_status: str
     ):
         if task_status == TaskStatus.SUCCESS.value:
             task.success()
-            task_queue_service.running_tasks.remove(task.id)
-            task_queue_service.execute_task()
+            # free the slot right away, the write itself is batched
+            task_queue_service.running_task_index.discard(task.id)
+            await task_queue_service.running_tasks.remove(task.id)
+            await task_queue_service.wakeup()
         else:
             task.status = task_status
         task.properties = properties
-        task_store_service.save(task)
+        task_status_pipeline.submit(task)
 
     async def on_message(self, message: discord.Message):
-        content = message.content
-        task_id, process = self.parse(content)
-        task = (
-            task_queue_service.get_running_task(task_id) if task_id else None
+        account = self.channel_accounts.get(str(message.channel.id))
+        if not account:
+            return
+        attachments = message.attachments
+        parsed = message_parser.parse(
+            message.content,
+            attachments[0].filename if attachments else None,
         )
-        if not task_id or not task:
+        # foreign or untracked tasks are dropped without a redis call
+        if (
+            not parsed
+            or parsed.task_id not in task_queue_service.running_task_index
+        ):
             return
 
-        msg_id = message.id
         properties = dict(
-            msg_id=str(msg_id),
+            msg_id=str(message.id),
             msg_hash="",
             attachment="",
         )
-        if "Waiting to start" in content:
+        if parsed.waiting:
             task_status = TaskStatus.IN_PROGRESS.value
+        elif attachments:
+            properties["msg_hash"] = parsed.msg_hash
+            properties["attachment"] = attachments[0].url
+            task_status = TaskStatus.SUCCESS.value
         else:
-            attachments = message.attachments
-            if attachments:
-                properties["msg_hash"] = (
-                    attachments[0].filename.split("_")[-1].split(".")[0]
-                )
-                properties["attachment"] = attachments[0].url
-                task_status = TaskStatus.SUCCESS.value
+            return
+
+        task = await task_queue_service.get_running_task(parsed.task_id)
+        if not task:
+            return
+        if task_status == TaskStatus.SUCCESS.value:
+            # follow-ups of this message must use the same account
+            await task_queue_service.bind_message(
+                properties["msg_id"], account
+            )
         await self.handle(task, properties, task_status)
 
     async def on_message_edit(
         self, before: discord.Message, after: discord.Message
     ):
-        content = after.content
-        task_id, process = self.parse(content, listen="on_message_edit")
-        task = (
-            task_queue_service.get_running_task(task_id) if task_id else None
-        )
-        if not task_id or not process or not task:
+        if str(after.channel.id) not in self.channel_accounts:
             return
-        task.process = process + "%"
-        await self.handle(
-            task,
-            properties=task.properties,
-            task_status=TaskStatus.IN_PROGRESS.value,
+        parsed = message_parser.parse(after.content)
+        if (
+            not parsed
+            or parsed.progress is None
+            or parsed.task_id not in task_queue_service.running_task_index
+        ):
+            return
+        # a single guarded write, stale or late edits are ignored
+        task = await task_store_service.update_progress(
+            parsed.task_id, parsed.progress
         )
-
-    def parse(self, content: str, listen: str = "on_message"):
-        task_id = process = None
-        if listen == "on_message":
-            match = re.search(r"<#(.*?)#>", content)
-            if match:
-                task_id = match.group(1)
-        else:
-            match = re.search(r"<#(.*?)#>.*?\((\d+)%\)", content)
-            if match:
-                task_id, process = match.group(1), match.group(2)
-        return task_id, process
+        if task:
+            await announce_task_changes([task])
 
 
 intents = discord.Intents.default()
@@ -0,0 +1,30 @@
+import os
+
+# app.config needs a full environment, tests never reach these services
+os.environ.update(
+    {
+        key: value
+        for key, value in {
+            "PROJECT_NAME": "midjourney-api",
+            "SERVER_HOST": "127.0.0.1",
+            "SERVER_PORT": "9999",
+            "DATABASE_URL": "sqlite://:memory:",
+            "REDIS_BROKER": "redis://127.0.0.1:6379/0",
+            "REDIS_BACKEND": "redis://127.0.0.1:6379/0",
+            "REDIS_TESTING": "true",
+            "REDIS_URL": "redis://127.0.0.1:6379/1",
+            "REDIS_HOST": "127.0.0.1",
+            "REDIS_PORT": "6379",
+            "DISCORD_USER_TOKEN": "user-token",
+            "DISCORD_BOT_TOKEN": "bot-token",
+            "DISCORD_GUILD_ID": "1",
+            "DISCORD_CHANNEL_ID": "1",
+            "DISCORD_APPLICATION_ID": "1",
+            "DISCORD_SESSION_ID": "session",
+            "NOTIFY_HOOK": "http://127.0.0.1:9000/notify",
+            "BAIDU_APPID": "appid",
+            "BAIDU_APPKEY": "appkey",
+        }.items()
+        if key not in os.environ
+    }
+)
@@ -0,0 +1,132 @@
+import asyncio
+import json
+from typing import Dict, List
+
+import pytest
+from aiohttp import web
+
+from app.config import settings
+from app.trigger.services.discord import DiscordService
+from app.utils.http import FetchStatusError
+
+
+class StubDiscord:
+    """Local stand-in for the interaction and attachment endpoints"""
+
+    def __init__(self, status: int = 204):
+        self.status = status
+        self.interactions: List[Dict] = []
+        self.uploads = 0
+        self.runner = None
+        self.url = ""
+
+    async def interaction(self, request: web.Request) -> web.Response:
+        self.interactions.append(await request.json())
+        # discord answers an accepted interaction without a body
+        return web.Response(status=self.status)
+
+    async def attachments(self, request: web.Request) -> web.Response:
+        files = (await request.json())["files"]
+        return web.json_response(
+            {
+                "attachments": [
+                    {
+                        "id": file["id"],
+                        "upload_url": f"{self.url}/upload",
+                        "upload_filename": f"uploads/{file['filename']}",
+                    }
+                    for file in files
+                ]
+            }
+        )
+
+    async def upload(self, request: web.Request) -> web.Response:
+        await request.read()
+        self.uploads += 1
+        return web.Response()
+
+    async def __aenter__(self) -> "StubDiscord":
+        app = web.Application()
+        app.router.add_post("/interactions", self.interaction)
+        app.router.add_post("/attachments", self.attachments)
+        app.router.add_put("/upload", self.upload)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.runner.cleanup()
+
+
+def make_service(stub: StubDiscord) -> DiscordService:
+    service = DiscordService(settings.DISCORD_ACCOUNTS[0])
+    service.TRIGGER_URL = stub.url + "/interactions"
+    service.upload_attachment_url = stub.url + "/attachments"
+
+    async def load_blob(image_ref: str) -> bytes:
+        return b"\x89PNG" + image_ref.encode()
+
+    service.load_blob = load_blob
+    return service
+
+
+TRIGGERS = {
+    "imagine": {"prompt": "a cat --ar 16:9"},
+    "upscale": {"msg_id": "1", "index": 1, "msg_hash": "abc"},
+    "variation": {"msg_id": "1", "index": 2, "msg_hash": "abc"},
+    "reset": {"msg_id": "1", "msg_hash": "abc"},
+    "describe": {"file_size": 10, "file_type": "png", "image_ref": "a"},
+    "blend": {
+        "file_size": 10,
+        "file_type": "png",
+        "image_ref": "a",
+        "file_size2": 10,
+        "file_type2": "png",
+        "image_ref2": "b",
+    },
+}
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, timeout=10))
+
+
+@pytest.mark.parametrize("command", TRIGGERS)
+def test_trigger_posts_one_interaction(command):
+    async def main():
+        async with StubDiscord() as stub:
+            service = make_service(stub)
+            await service.setup()
+            try:
+                result = await getattr(service, command)(**TRIGGERS[command])
+            finally:
+                await service.close()
+        return stub, result
+
+    stub, result = run(main())
+    assert result
+    assert len(stub.interactions) == 1
+    channel_id = settings.DISCORD_ACCOUNTS[0].channel_id
+    assert stub.interactions[0]["channel_id"] == channel_id
+
+
+@pytest.mark.parametrize("command", TRIGGERS)
+def test_rejected_trigger_is_not_retried(command):
+    async def main():
+        async with StubDiscord(status=429) as stub:
+            service = make_service(stub)
+            await service.setup()
+            try:
+                with pytest.raises(FetchStatusError) as exc_info:
+                    await getattr(service, command)(**TRIGGERS[command])
+            finally:
+                await service.close()
+        return stub, exc_info.value
+
+    stub, error = run(main())
+    assert error.status == 429
+    assert len(stub.interactions) == 1
@@ -0,0 +1,43 @@
+import pytest
+
+from app.trigger.services.parser import ParsedMessage, message_parser
+
+
+@pytest.mark.parametrize(
+    "content, progress, waiting",
+    [
+        ("**<#ab1#> a cat** - <@123> (31%) (fast)", 31, False),
+        ("**<#ab1#> a cat** - <@123> (Waiting to start)", None, True),
+        (
+            "**<#ab1#> a cat** - Variations (Strong) by <@123> (12%) (fast)",
+            12,
+            False,
+        ),
+        ("**<#ab1#> a cat** - Remix (Subtle) by <@123> (46%)", 46, False),
+        (
+            "**<#ab1#> a cat** - Variations (Strong) by <@123> "
+            "(Waiting to start)",
+            None,
+            True,
+        ),
+        ("**<#ab1#> a cat** - Image #1 <@123>", None, False),
+        ("**<#ab1#> a cat (50%)** - <@123> (fast)", None, False),
+        ("**<#ab1#> (Waiting to start)** - <@123> (relaxed)", None, False),
+    ],
+)
+def test_parse_progress(content, progress, waiting):
+    assert message_parser.parse(content) == ParsedMessage(
+        task_id="ab1", progress=progress, waiting=waiting
+    )
+
+
+def test_parse_msg_hash():
+    parsed = message_parser.parse(
+        "**<#ab1#> a cat** - <@123> (fast)", "user_a_cat_3f2b9c.png"
+    )
+    assert parsed.msg_hash == "3f2b9c"
+
+
+@pytest.mark.parametrize("content", ["", "a cat", "**<# a cat** - <@123>"])
+def test_parse_foreign_message(content):
+    assert message_parser.parse(content) is None
@@ -0,0 +1,109 @@
+import asyncio
+import time
+
+from fakeredis import aioredis
+
+from app.trigger.enums import TaskAction, TaskStatus
+from app.trigger.schemas.task import Task, TaskQuery
+from app.trigger.services.store import RedisTaskStoreService
+from app.utils.rerequest import PaginationRequest
+
+
+def run(test):
+    async def main():
+        await test(RedisTaskStoreService(aioredis.FakeRedis()))
+
+    asyncio.run(asyncio.wait_for(main(), timeout=10))
+
+
+def make_task(task_id: str = "1") -> Task:
+    return Task(
+        id=task_id,
+        action=TaskAction.IMAGINE.value,
+        prompt="a cat",
+        submit_time=int(time.time() * 1000),
+    )
+
+
+async def status_ids(store: RedisTaskStoreService, status: str):
+    page = await store.find_all(
+        TaskQuery(status=status), PaginationRequest(page_size=10)
+    )
+    return [task.id for task in page.rows]
+
+
+def test_save_round_trip_and_status_index():
+    async def test(store):
+        task = make_task()
+        assert await store.save(task) == task
+        task.start()
+        assert (await store.save(task)).status == TaskStatus.SUBMITTED
+        assert await status_ids(store, TaskStatus.NOT_START.value) == []
+        assert await status_ids(store, TaskStatus.SUBMITTED.value) == ["1"]
+        assert await store.get("1") == task
+
+    run(test)
+
+
+def test_stale_snapshot_keeps_progress():
+    async def test(store):
+        task = make_task()
+        task.start()
+        await store.save(task)
+        await store.update_progress("1", 60)
+        # the bot's snapshot was loaded before the progress edit
+        task.status = TaskStatus.IN_PROGRESS.value
+        task.properties = {"msg_id": "2"}
+        saved = await store.save(task)
+        assert saved.process == "60%"
+        assert saved.properties == {"msg_id": "2"}
+        assert (await store.get("1")).process == "60%"
+
+    run(test)
+
+
+def test_finished_task_is_never_changed():
+    async def test(store):
+        task = make_task()
+        task.start()
+        await store.save(task)
+        failed = task.copy()
+        failed.fail("timeout")
+        assert (await store.save(failed)).status == TaskStatus.FAILURE
+        succeeded = task.copy()
+        succeeded.success()
+        running = task.copy()
+        running.status = TaskStatus.IN_PROGRESS.value
+        assert await store.save_many([succeeded, running]) == [None, None]
+        assert (await store.get("1")).fail_reason == "timeout"
+        assert await status_ids(store, TaskStatus.FAILURE.value) == ["1"]
+        assert await store.update_progress("1", 80) is None
+
+    run(test)
+
+
+def test_status_never_goes_back():
+    async def test(store):
+        task = make_task()
+        task.status = TaskStatus.IN_PROGRESS.value
+        await store.save(task)
+        task.status = TaskStatus.SUBMITTED.value
+        assert await store.save(task) is None
+        assert (await store.get("1")).status == TaskStatus.IN_PROGRESS
+
+    run(test)
+
+
+def test_legacy_json_task_is_migrated():
+    async def test(store):
+        task = make_task()
+        await store.redis_client.set(
+            store.LEGACY_KEY_PREFIX + task.id, task.json()
+        )
+        assert await store.get_many([task.id, "2"]) == [task, None]
+        assert not await store.redis_client.exists(
+            store.LEGACY_KEY_PREFIX + task.id
+        )
+        assert await status_ids(store, TaskStatus.NOT_START.value) == ["1"]
+
+    run(test)
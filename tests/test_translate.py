@@ -0,0 +1,147 @@
+import asyncio
+from typing import Dict, List
+
+from aiohttp import web
+
+from app.trigger.services.translate import TranslateService
+
+
+class MemoryRedis:
+    """The two commands the translate cache uses"""
+
+    def __init__(self):
+        self.data: Dict[str, bytes] = {}
+
+    async def get(self, key: str):
+        return self.data.get(key)
+
+    async def set(self, key: str, value: str, ex: int = None):
+        self.data[key] = value.encode("utf-8")
+
+
+class StubTranslator:
+    """Local stand-in for the baidu api, segments are translated per line"""
+
+    def __init__(self, delay: float = 0.05):
+        self.delay = delay
+        self.requests: List[List[str]] = []
+        self.runner = None
+        self.url = ""
+
+    async def handle(self, request: web.Request) -> web.Response:
+        lines = request.query["q"].split("\n")
+        self.requests.append(lines)
+        await asyncio.sleep(self.delay)
+        return web.json_response(
+            {"trans_result": [{"src": q, "dst": f"en:{q}"} for q in lines]}
+        )
+
+    async def __aenter__(self) -> "StubTranslator":
+        app = web.Application()
+        app.router.add_post("/translate", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}/translate"
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.runner.cleanup()
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, timeout=10))
+
+
+def make_service(stub: StubTranslator) -> TranslateService:
+    service = TranslateService(MemoryRedis())
+    service.TRANSLATE_URL = stub.url
+    return service
+
+
+def test_concurrent_prompts_share_requests():
+    prompts = ["一只猫", "一只狗", "城市夜景", "森林", "海边日落"]
+
+    async def main():
+        async with StubTranslator() as stub:
+            service = make_service(stub)
+            try:
+                results = await asyncio.gather(
+                    *(service.translate_segment(p) for p in prompts * 4)
+                )
+            finally:
+                await service.close()
+        return service, stub, results
+
+    service, stub, results = run(main())
+    assert results == [f"en:{p}" for p in prompts * 4]
+    # every distinct prompt was sent once, all in one batch
+    assert stub.requests == [prompts]
+    assert service.stats["misses"] == len(prompts)
+    assert service.stats["coalesced"] == len(prompts) * 3
+    metrics = service.metrics()
+    assert metrics["batches"] == 1
+    assert metrics["local_cache_size"] == len(prompts)
+    assert metrics["hit_ratio"] == 0.75
+
+
+def test_translate_to_en_keeps_protected_parts():
+    async def main():
+        async with StubTranslator() as stub:
+            service = make_service(stub)
+            try:
+                return await asyncio.gather(
+                    service.translate_to_en("一只猫 --ar 16:9"),
+                    service.translate_to_en("https://a.b/c.png 一只猫"),
+                )
+            finally:
+                await service.close()
+
+    assert run(main()) == [
+        "en:一只猫 --ar 16:9",
+        "https://a.b/c.png en:一只猫",
+    ]
+
+
+def test_cancelled_lookup_does_not_hang_waiters():
+    async def main():
+        async with StubTranslator() as stub:
+            service = make_service(stub)
+            try:
+                leader = asyncio.create_task(service.translate_segment("猫"))
+                await asyncio.sleep(0)
+                waiters = [
+                    asyncio.create_task(service.translate_segment("猫"))
+                    for _ in range(3)
+                ]
+                await asyncio.sleep(0)
+                leader.cancel()
+                results = await asyncio.gather(*waiters)
+            finally:
+                await service.close()
+        return service, leader, results
+
+    service, leader, results = run(main())
+    assert leader.cancelled()
+    assert results == ["en:猫"] * 3
+    assert not service._inflight
+
+
+def test_failed_batch_reaches_every_waiter():
+    async def main():
+        async with StubTranslator() as stub:
+            service = make_service(stub)
+            service.TRANSLATE_URL = stub.url + "/missing"
+            try:
+                return await asyncio.gather(
+                    *(service.translate_segment("猫") for _ in range(3)),
+                    return_exceptions=True,
+                )
+            finally:
+                await service.close()
+
+    results = run(main())
+    assert len(results) == 3
+    assert all(isinstance(result, Exception) for result in results)